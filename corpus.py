@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import json
+import struct
+import numpy as np
+from bisect import bisect_right
+from typing import List, Tuple, Optional, Union, Iterator, Iterable
+
+
+Symbol = str
+Word = List[Symbol]
+
+# Binary corpus layout: MAGIC, header length (uint64), json header padded to 8 bytes, word offsets (int64, n+1),
+# symbol ids of every word concatenated (int8) and the labels bitmap (bit i of byte i // 8 is True for positives)
+MAGIC = b'GICORPUS'
+
+
+def is_corpus(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_corpus(path: str, cases: List[Tuple[Word, bool]], alphabet: Iterable[Symbol], grammar_path: Optional[str] = None) -> None:
+    alphabet = sorted(alphabet)
+    if len(alphabet) > 127:
+        raise ValueError(f'Alphabets of {len(alphabet)} symbols do not fit in int8 ids')
+    index = {a: i for i, a in enumerate(alphabet)}
+    offsets = np.zeros(len(cases) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(w) for w, _ in cases])
+    header = json.dumps({'alphabet': alphabet, 'n_words': len(cases), 'n_symbols': int(offsets[-1]), 'grammar_path': grammar_path}).encode()
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        f.write(offsets.tobytes())
+        for w, _ in cases:
+            f.write(bytes(index[a] for a in w))
+        f.write(np.packbits(np.array([p for _, p in cases], dtype=bool), bitorder='little').tobytes())
+
+
+def read_header(path: str) -> dict:
+    # The json header along with 'data_offset', the position of the offsets array in the file
+    with open(path, 'rb') as f:
+        f.seek(len(MAGIC))
+        size, = struct.unpack('<Q', f.read(8))
+        return {**json.loads(f.read(size)), 'data_offset': len(MAGIC) + 8 + size}
+
+
+def cases_metadata(path: str) -> dict:
+    # Header of a binary corpus or the whole json cases file
+    if is_corpus(path):
+        return read_header(path)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class Corpus:
+    # Memory-mapped binary corpus, nothing is read until a word is accessed
+    def __init__(self, path: str) -> None:
+        self.path : str = path
+        header = read_header(path)
+        self.alphabet : List[Symbol] = header['alphabet']
+        self.grammar_path : Optional[str] = header['grammar_path']
+        n, n_symbols = header['n_words'], header['n_symbols']
+
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+        start = header['data_offset']
+        self.offsets : np.ndarray = data[start: start + 8 * (n+1)].view(np.int64)
+        start += 8 * (n+1)
+        self.symbols : np.ndarray = data[start: start + n_symbols].view(np.int8)
+        self.labels : np.ndarray = data[start + n_symbols: start + n_symbols + (n + 7) // 8]
+
+    def __getstate__(self) -> dict:
+        # Processes reopen the file instead of receiving a copy of the data
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['path'])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def ids(self, i: int) -> np.ndarray:
+        return self.symbols[self.offsets[i]:self.offsets[i+1]]
+
+    def word(self, i: int) -> Word:
+        return [self.alphabet[a] for a in self.ids(i).tolist()]
+
+    def label(self, i: int) -> bool:
+        return bool(self.labels[i >> 3] >> (i & 7) & 1)
+
+    def __getitem__(self, i: int) -> Tuple[Word, bool]:
+        return self.word(i), self.label(i)
+
+    def view(self, order: Optional[np.ndarray] = None) -> CaseView:
+        return CaseView(self, [np.arange(len(self), dtype=np.int64) if order is None else order])
+
+
+class CaseView:
+    # Sequence of the cases of a corpus in the order given by the concatenation of the index arrays in parts. Slices
+    # and concatenations only create new views of the indexes, the cases are decoded when they are accessed
+    def __init__(self, corpus: Corpus, parts: List[np.ndarray]) -> None:
+        self.corpus : Corpus = corpus
+        self.parts : List[np.ndarray] = [part for part in parts if len(part)]
+        self.starts : List[int] = [0]
+        for part in self.parts:
+            self.starts.append(self.starts[-1] + len(part))
+
+    def __len__(self) -> int:
+        return self.starts[-1]
+
+    def index(self, i: int) -> int:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('CaseView index out of range')
+        part = bisect_right(self.starts, i) - 1
+        return int(self.parts[part][i - self.starts[part]])
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Tuple[Word, bool], CaseView]:
+        if not isinstance(key, slice):
+            return self.corpus[self.index(key)]
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            return CaseView(self.corpus, [np.concatenate(self.parts or [np.zeros(0, dtype=np.int64)])[key]])
+        parts = []
+        for part, first in zip(self.parts, self.starts):
+            if first < stop and start < first + len(part):
+                parts.append(part[max(start - first, 0): stop - first])
+        return CaseView(self.corpus, parts)
+
+    def __add__(self, other: CaseView) -> CaseView:
+        if other.corpus is not self.corpus:
+            raise ValueError('Only views of the same corpus can be concatenated')
+        return CaseView(self.corpus, self.parts + other.parts)
+
+    def labels(self) -> List[bool]:
+        # Read from the bitmap without decoding the words
+        indexes = np.concatenate(self.parts or [np.zeros(0, dtype=np.int64)])
+        return ((self.corpus.labels[indexes >> 3] >> (indexes & 7)) & 1).astype(bool).tolist()
+
+    def __iter__(self) -> Iterator[Tuple[Word, bool]]:
+        for part in self.parts:
+            for i in part.tolist():
+                yield self.corpus[i]
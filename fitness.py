@@ -1,36 +1,55 @@
+import random
+import numpy as np
 from math import floor, ceil
 from itertools import product
-from random import choices, randint
-from typing import Set, Dict, Tuple, List, Optional, Generator, TypeVar, Callable
+from collections import defaultdict
+from random import getrandbits
+from typing import Set, Dict, Tuple, List, Optional, Generator, TypeVar, Callable, Hashable, Union, Iterator, Sequence
 
-from grammar import Grammar
+from cache import LRUCache
+from instrumentation import counters
+from grammar import Grammar, CompiledGrammar, WordEnumerator
+from genome import TERMINAL
 
 
 Symbol = str
 Word = List[Symbol]
 T = TypeVar('T')
+AnyGrammar = Union[Grammar, CompiledGrammar]
 
 
-def cyk_table(g: Grammar, w: Word) -> Dict[Tuple[int, int], Set[Symbol]]:
+def cyk_chart(g: AnyGrammar, w: Word) -> List[List[int]]:
+    # chart[j-1][i-1] is the bitmask of the non-terminals deriving w[i-1:i-1+j]
+    cg = g.compiled()
     n = len(w)
-    v = {}
-
-    for i in range(1, n+1):
-        v[i, 1] = {a for (a, bc) in g.productions_iterator() if len(bc) == 1 and bc[0] == w[i-1]}
+    terminal = cg.terminal
+    chart = [[terminal.get(a, 0) for a in w]]
 
     for j in range(2, n+1):
-        for i in range(1, n-j+2):
-            v[i, j] = set()
+        row = []
+        for i in range(n-j+1):
+            mask = 0
             for k in range(1, j):
-                v[i, j] = v[i, j].union({a for (a, bc) in g.productions_iterator()
-                                           if len(bc) == 2 and bc[0] in v[i, k] and bc[1] in v[i+k, j-k]})
-    return v
+                left = chart[k-1][i]
+                if left:
+                    right = chart[j-k-1][i+k]
+                    if right:
+                        mask |= cg.combine(left, right)
+            row.append(mask)
+        chart.append(row)
+    return chart
+
 
+def cyk_table(g: AnyGrammar, w: Word) -> Dict[Tuple[int, int], Set[Symbol]]:
+    cg = g.compiled()
+    chart = cyk_chart(g, w)
+    return {(i+1, j+1): cg.symbols_of(mask) for j, row in enumerate(chart) for i, mask in enumerate(row)}
 
-def cyk(g: Grammar, w: Word) -> bool:
+
+def cyk(g: AnyGrammar, w: Word) -> bool:
     n = len(w)
-    v = cyk_table(g, w)
-    return g.s in v[1, n]
+    chart = cyk_chart(g, w)
+    return bool(g.compiled().s_mask & chart[n-1][0])
 
 
 def hamming_distance(wt: Word, wg: Word) -> float:
@@ -49,25 +68,372 @@ def print_cyk_table(table: Dict[Tuple[int, int], Set[Symbol]], w: Word):
             print('[' + cont + (max_cell_size - len(cont)) * ' ' + '] ', end='')
         print('')
 
-def cyk_fitness(g: Grammar, w: Word) -> float:
+class SubstringMemo:
+    # Trie of the substrings parsed with one grammar, each node is [non-terminals mask or None, children]
+    def __init__(self, max_nodes: Optional[int] = 2**16) -> None:
+        self.root: list = [None, {}]
+        self.max_nodes: int = max_nodes
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def child(self, node: Optional[list], symbol: Symbol) -> Optional[list]:
+        # None once the node cap is reached, those substrings are parsed without memo
+        if node is None:
+            return None
+        out = node[1].get(symbol)
+        if out is None and self.size < self.max_nodes:
+            out = node[1][symbol] = [None, {}]
+            self.size += 1
+        return out
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+
+def cyk_fitness_early(g: AnyGrammar, w: Word, memo: Optional[SubstringMemo] = None) -> Tuple[float, int]:
+    # Same score as filling the whole chart, returns it along with the number of chart cells that were skipped
+    cg = g.compiled()
     n = len(w)
-    v = cyk_table(g, w)
-    for j in range(n, 0, -1):
-        if any(g.s in v[i, j] for i in range(1, n-j+2)):
-            return j / n
-    return 0
+    s_mask, useful = cg.s_mask, cg.useful
+    row = [cg.terminal.get(a, 0) & useful for a in w]
+    chart = [row]
+    non_empty = [False, any(row)]
+    longest = 1 if non_empty[1] else 0
+    best = 1 if any(s_mask & mask for mask in row) else 0
+    filled = n
+    nodes = [memo.child(memo.root, a) for a in w] if memo is not None else [None] * n
+
+    for j in range(2, n+1):
+        # A span of length j needs two non empty shorter spans, so no span longer than 2 * longest can be derived
+        if j > 2 * longest:
+            break
+        if memo is not None:
+            nodes = [memo.child(nodes[i], w[i+j-1]) for i in range(n-j+1)]
+        splits = [k for k in range(1, j) if non_empty[k] and non_empty[j-k]]
+        if not splits:
+            chart.append(None)
+            non_empty.append(False)
+            continue
+
+        row = []
+        for i in range(n-j+1):
+            node = nodes[i]
+            if node is not None and node[0] is not None:
+                memo.hits += 1
+                row.append(node[0])
+                continue
+
+            mask = 0
+            for k in splits:
+                left = chart[k-1][i]
+                if left:
+                    right = chart[j-k-1][i+k]
+                    if right:
+                        mask |= cg.combine(left, right)
+                        if mask == useful:
+                            break
+            row.append(mask)
+            if node is not None:
+                memo.misses += 1
+                node[0] = mask
+        chart.append(row)
+        filled += n-j+1
+
+        non_empty.append(any(row))
+        if non_empty[j]:
+            longest = j
+            if any(s_mask & mask for mask in row):
+                best = j
+
+    return (best / n if best else 0), n * (n+1) // 2 - filled
+
+
+def cyk_fitness(g: AnyGrammar, w: Word) -> float:
+    return cyk_fitness_early(g, w)[0]
+
+
+def encode_words(words: List[Word], alphabet: List[Symbol]) -> np.ndarray:
+    # Symbols out of the alphabet get the id len(alphabet)
+    index = {a: i for i, a in enumerate(alphabet)}
+    return np.array([[index.get(a, len(alphabet)) for a in w] for w in words], dtype=np.int32).reshape(len(words), -1)
+
+
+def batch_cyk_fitness(g: AnyGrammar, words: np.ndarray, alphabet: List[Symbol]) -> np.ndarray:
+    # cyk_fitness of a (batch, n) stack of equal-length words encoded with encode_words, chart[:, j-1, i, a] is
+    # True when the non-terminal a derives the span of length j starting at i
+    cg = g.compiled()
+    batch, n = words.shape
+    if n == 0:
+        return np.zeros(batch)
+    useful = [i for i in range(len(cg.symbols)) if cg.useful >> i & 1]
+    if not useful:
+        return np.zeros(batch)
+    column = {a: i for i, a in enumerate(useful)}
+
+    terminal = np.zeros((len(alphabet) + 1, len(useful)), dtype=bool)
+    for t, symbol in enumerate(alphabet):
+        mask = cg.terminal.get(symbol, 0)
+        terminal[t] = [bool(mask >> a & 1) for a in useful]
+    rules = [(column[b], column[c], column[a]) for (b, c), a_mask in cg.binary.items()
+             for a in useful if a_mask >> a & 1]
+    left_index = np.array([r[0] for r in rules], dtype=np.intp)
+    right_index = np.array([r[1] for r in rules], dtype=np.intp)
+    produces = np.zeros((len(rules), len(useful)), dtype=np.float32)
+    produces[np.arange(len(rules)), [r[2] for r in rules]] = 1
+
+    chart = np.zeros((batch, n, n, len(useful)), dtype=bool)
+    chart[:, 0] = terminal[words]
+    for j in range(2, n+1):
+        if not rules:
+            break
+        m = n-j+1
+        left = np.stack([chart[:, k-1, :m] for k in range(1, j)])
+        right = np.stack([chart[:, j-k-1, k:k+m] for k in range(1, j)])
+        hits = (left[..., left_index] & right[..., right_index]).any(axis=0)
+        chart[:, j-1, :m] = hits.astype(np.float32) @ produces > 0
+
+    spans = chart[..., column[cg.s_mask.bit_length() - 1]].any(axis=2)
+    longest = np.where(spans.any(axis=1), n - np.argmax(spans[:, ::-1], axis=1), 0)
+    return longest / n
+
+
+class CaseBatch:
+    # Cases of a train step or a test set encoded once and shared, read-only, by every membrane and genome: the words,
+    # their cache keys, labels and the words grouped by length, lengths[n] = (indexes, (k, n) stack of their symbol ids
+    # in alphabet, see encode_words), for the batch evaluators. It is also the sequence of its cases
+    def __init__(self, cases: List[Tuple[Word, bool]], alphabet: List[Symbol], keys: Optional[List[Tuple[Symbol, ...]]] = None,
+                 ids: Optional[List[np.ndarray]] = None) -> None:
+        self.cases : List[Tuple[Word, bool]] = cases
+        self.alphabet : List[Symbol] = alphabet
+        self.words : List[Word] = [w for w, _ in cases]
+        self.labels : List[bool] = [p for _, p in cases]
+        self.keys : List[Tuple[Symbol, ...]] = [tuple(w) for w in self.words] if keys is None else keys
+
+        groups = defaultdict(list)
+        for i, w in enumerate(self.words):
+            groups[len(w)].append(i)
+        # Position of each word in the stack of its length
+        self.row : np.ndarray = np.zeros(len(cases), dtype=np.intp)
+        self.lengths : Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for length, indexes in groups.items():
+            if ids is None:
+                stack = encode_words([self.words[i] for i in indexes], alphabet)
+            else:
+                stack = np.stack([ids[i] for i in indexes]).reshape(len(indexes), length)
+            indexes = np.array(indexes, dtype=np.intp)
+            self.row[indexes] = np.arange(len(indexes))
+            indexes.setflags(write=False)
+            stack.setflags(write=False)
+            self.lengths[length] = indexes, stack
+        self.row.setflags(write=False)
+
+    def __len__(self) -> int:
+        return len(self.cases)
+
+    def __getitem__(self, i: int) -> Tuple[Word, bool]:
+        return self.cases[i]
+
+    def __iter__(self) -> Iterator[Tuple[Word, bool]]:
+        return iter(self.cases)
+
+    def ids(self, indexes: List[int]) -> np.ndarray:
+        # Stack of the ids of the words in indexes, increasing and all of the same length
+        group, stack = self.lengths[len(self.words[indexes[0]])]
+        return stack if len(indexes) == len(group) else stack[self.row[indexes]]
+
 
+class BatchScheduler:
+    # Builds the CaseBatch of every train step from the indexes of its cases. A list of cases is encoded once, other
+    # sequences (corpus views) are encoded batch by batch so they are never held in memory
+    def __init__(self, cases: Sequence[Tuple[Word, bool]], alphabet: List[Symbol], batch_size: int) -> None:
+        self.cases : Sequence[Tuple[Word, bool]] = cases
+        self.alphabet : List[Symbol] = alphabet
+        self.batch_size : int = batch_size
+        self.keys : Optional[List[Tuple[Symbol, ...]]] = None
+        self.ids : Optional[List[np.ndarray]] = None
+        if isinstance(cases, list):
+            index = {a: i for i, a in enumerate(alphabet)}
+            self.keys = [tuple(w) for w, _ in cases]
+            self.ids = [np.array([index.get(a, len(alphabet)) for a in w], dtype=np.int32) for w, _ in cases]
 
-def fitness(g: Grammar, w: Word, positive: bool) -> float:
+    def __len__(self) -> int:
+        return ceil(len(self.cases) / self.batch_size)
+
+    def batch(self, order: List[int], i: int) -> CaseBatch:
+        # The i-th batch of the cases in order
+        indexes = order[i*self.batch_size:(i+1)*self.batch_size]
+        cases = [self.cases[j] for j in indexes]
+        if self.ids is None:
+            return CaseBatch(cases, self.alphabet)
+        return CaseBatch(cases, self.alphabet, [self.keys[j] for j in indexes], [self.ids[j] for j in indexes])
+
+
+class CaseChunks:
+    # Cases too many to be decoded at once, as the test fold of a corpus, iterated as a CaseBatch of every chunk_size
+    # cases built when it is needed. Cases that fit in one chunk are encoded once and kept
+    def __init__(self, cases: Sequence[Tuple[Word, bool]], alphabet: List[Symbol], chunk_size: Optional[int] = 2**12) -> None:
+        self.cases : Sequence[Tuple[Word, bool]] = cases
+        self.alphabet : List[Symbol] = alphabet
+        self.chunk_size : int = chunk_size
+        self.batch : Optional[CaseBatch] = CaseBatch(list(cases), alphabet) if len(cases) <= chunk_size else None
+
+    def __len__(self) -> int:
+        return len(self.cases)
+
+    def __iter__(self) -> Iterator[CaseBatch]:
+        if self.batch is not None:
+            yield self.batch
+            return
+        for i in range(0, len(self.cases), self.chunk_size):
+            yield CaseBatch(list(self.cases[i:i+self.chunk_size]), self.alphabet)
+
+
+def cyk_fitness_many(g: AnyGrammar, words: Union[List[Word], CaseBatch], batch_min: Optional[int] = 16, memo: Optional[SubstringMemo] = None,
+                     selected: Optional[List[int]] = None) -> List[float]:
+    # Words are grouped by length, groups with at least batch_min words are parsed at once with batch_cyk_fitness and
+    # the rest share a substring memo, g must be the grammar the memo was filled with. With a CaseBatch only its words
+    # in selected (increasing) are parsed and their ids are taken from it
+    batch = words if isinstance(words, CaseBatch) else None
+    if batch is not None:
+        words = [batch.words[i] for i in selected]
+    out = [0.0] * len(words)
+    groups = defaultdict(list)
+    for i, w in enumerate(words):
+        groups[len(w)].append(i)
+    if memo is None and len(words) > 1:
+        memo = SubstringMemo()
+    memo_before = (memo.hits, memo.misses) if memo is not None else None
+
+    alphabet = None
+    for length, indexes in groups.items():
+        if len(indexes) >= batch_min and length > 1:
+            if batch is not None:
+                scores = batch_cyk_fitness(g, batch.ids([selected[i] for i in indexes]), batch.alphabet)
+            else:
+                if alphabet is None:
+                    alphabet = sorted(g.compiled().terminal)
+                scores = batch_cyk_fitness(g, encode_words([words[i] for i in indexes], alphabet), alphabet)
+            for i, score in zip(indexes, scores.tolist()):
+                out[i] = score
+            if counters.enabled:
+                counters.add('cyk_cells', len(indexes) * length * (length+1) // 2)
+        else:
+            for i in indexes:
+                out[i], skipped = cyk_fitness_early(g, words[i], memo)
+                if counters.enabled:
+                    counters.add('cyk_cells', length * (length+1) // 2 - skipped)
+    if counters.enabled:
+        counters.add('cyk_words', len(words))
+        if memo is not None:
+            counters.add('substring_hits', memo.hits - memo_before[0])
+            counters.add('substring_misses', memo.misses - memo_before[1])
+    return out
+
+
+def cyk_oracle(g: Grammar, batch_max_length: Optional[int] = 32, batch_size: Optional[int] = 256) -> Callable[[np.ndarray], np.ndarray]:
+    # Generic membership oracle (see oracles.py), short words are parsed in batches and long ones one by one
+    alphabet = sorted(g.terminal)
+
+    def accepts(words: np.ndarray) -> np.ndarray:
+        if words.shape[1] <= batch_max_length:
+            return np.concatenate([batch_cyk_fitness(g, words[i:i+batch_size], alphabet) == 1
+                                   for i in range(0, len(words), batch_size)] or [np.zeros(0, dtype=bool)])
+        return np.array([cyk_fitness_early(g, [alphabet[a] for a in w])[0] == 1
+                         for w in words.tolist()], dtype=bool)
+    return accepts
+
+
+def fitness(g: AnyGrammar, w: Word, positive: bool) -> float:
     fit = cyk_fitness(g, w)
     fit = fit if positive else 1 - fit
     return fit
 
 
-def multiple_fitness(g: Grammar, cases: List[Tuple[Word, bool]]) -> float:
+def multiple_fitness(g: AnyGrammar, cases: List[Tuple[Word, bool]], memo: Optional[SubstringMemo] = None) -> float:
     # print(g.serializable())
     # print(''.join(str(fitness(g, w, p)) for w, p in cases))
-    return sum(fitness(g, w, p) for w, p in cases)
+    scores = cyk_fitness_many(g, [w for w, _ in cases], memo=memo)
+    return sum(fit if p else 1 - fit for fit, (_, p) in zip(scores, cases))
+
+
+def cached_cyk_fitness(cache: LRUCache[float], key: Hashable, decode: Callable[[], AnyGrammar], words: Union[List[Word], CaseBatch]) -> List[float]:
+    # The cache stores the raw cyk_fitness of each (genome, word) pair, the grammar is only decoded on a miss. The words
+    # of a CaseBatch reuse its keys and encoding
+    if isinstance(words, CaseBatch):
+        word_keys = [(key, w) for w in words.keys]
+    else:
+        word_keys = [(key, tuple(w)) for w in words]
+    scores = [cache.get(word_key) for word_key in word_keys]
+    missing = [i for i, fit in enumerate(scores) if fit is None]
+    if missing:
+        g = decode()
+        parsed = cyk_fitness_many(g, words, selected=missing) if isinstance(words, CaseBatch) else cyk_fitness_many(g, [words[i] for i in missing])
+        for i, fit in zip(missing, parsed):
+            scores[i] = fit
+            cache.put(word_keys[i], fit)
+    return scores
+
+
+def cached_multiple_fitness(cache: LRUCache[float], key: Hashable, decode: Callable[[], AnyGrammar], cases: Union[List[Tuple[Word, bool]], CaseBatch]) -> float:
+    scores = cached_cyk_fitness(cache, key, decode, cases if isinstance(cases, CaseBatch) else [w for w, _ in cases])
+    return sum(fit if p else 1 - fit for fit, (_, p) in zip(scores, cases))
+
+
+def population_cyk(rules: np.ndarray, terminals: np.ndarray, s_index: int, words: np.ndarray) -> np.ndarray:
+    # (genome, word) cyk_fitness of a (batch, n) stack of equal-length words, see population_fitness
+    n_genomes, n_symbols = terminals.shape[0], terminals.shape[2]
+    batch, n = words.shape
+    chart = np.zeros((n_genomes, batch, n, n, n_symbols), dtype=bool)
+    chart[:, :, 0] = terminals[:, words]
+    for j in range(2, n+1):
+        m = n-j+1
+        left = np.stack([chart[:, :, k-1, :m] for k in range(1, j)])
+        right = np.stack([chart[:, :, j-k-1, k:k+m] for k in range(1, j)])
+        pairs = (left[..., :, None] & right[..., None, :]).any(axis=0).reshape(n_genomes, batch * m, n_symbols * n_symbols)
+        chart[:, :, j-1, :m] = (np.matmul(pairs.astype(np.float32), rules) > 0).reshape(n_genomes, batch, m, n_symbols)
+
+    spans = chart[..., s_index].any(axis=3)
+    return np.where(spans.any(axis=2), n - np.argmax(spans[..., ::-1], axis=2), 0) / n
+
+
+def population_fitness(non_terminal: Set[Symbol], terminal: Set[Symbol], s: Symbol, genomes: np.ndarray, cases: Union[List[Tuple[Word, bool]], CaseBatch]) -> np.ndarray:
+    # multiple_fitness of every array genome (see genome.GenomeCodec) of a population, the population is stacked into a
+    # (genome, B, C, A) rule tensor and each word fills a (genome, span, start, non_terminal) chart. The words of the same
+    # length of a CaseBatch encoded with the same alphabet share a single chart
+    symbols, alphabet = sorted(non_terminal), sorted(terminal)
+    t_index = {a: i for i, a in enumerate(alphabet)}
+    n_genomes, n_symbols = len(genomes), len(symbols)
+
+    rules = np.zeros((n_genomes, n_symbols, n_symbols, n_symbols), dtype=np.float32)
+    terminals = np.zeros((n_genomes, len(alphabet) + 1, n_symbols), dtype=bool)
+    g, prod = np.nonzero(genomes[..., 2] != TERMINAL)
+    rules[g, genomes[g, prod, 1], genomes[g, prod, 2], genomes[g, prod, 0]] = 1
+    g, prod = np.nonzero(genomes[..., 2] == TERMINAL)
+    terminals[g, genomes[g, prod, 1], genomes[g, prod, 0]] = True
+    rules = rules.reshape(n_genomes, n_symbols * n_symbols, n_symbols)
+    s_index = symbols.index(s)
+
+    fits = np.zeros((n_genomes, len(cases)))
+    if isinstance(cases, CaseBatch) and cases.alphabet == alphabet:
+        for indexes, words in cases.lengths.values():
+            # Chunks of words with charts of about 2**22 cells
+            step = max(1, 2**22 // max(n_genomes * words.shape[1] ** 2 * n_symbols, 1))
+            for i in range(0, len(words), step):
+                fits[:, indexes[i:i+step]] = population_cyk(rules, terminals, s_index, words[i:i+step])
+    else:
+        for i, (w, _) in enumerate(cases):
+            fits[:, i] = population_cyk(rules, terminals, s_index, np.array([[t_index.get(a, len(alphabet)) for a in w]], dtype=np.intp))[:, 0]
+
+    # Added in the order of the cases, as multiple_fitness
+    total = np.zeros(n_genomes)
+    for i, (_, p) in enumerate(cases):
+        total += fits[:, i] if p else 1 - fits[:, i]
+    if counters.enabled:
+        counters.add('cyk_words', n_genomes * len(cases))
+        counters.add('cyk_cells', n_genomes * sum(len(w) * (len(w)+1) // 2 for w, _ in cases))
+    return total
 
 
 def cases_generator(g: Grammar, n: Optional[int] = None) -> Generator[Tuple[Word, bool], None, None]:
@@ -80,8 +446,8 @@ def cases_generator(g: Grammar, n: Optional[int] = None) -> Generator[Tuple[Word
         size += 1
 
 
-def balanced_cases(g: Grammar, n: int, positive_rate: Optional[float] = 0.5) -> Tuple[List[Tuple[Word, bool]],  List[Tuple[Word, bool]]]:
-    it = g.words_iterator()
+def balanced_cases(g: Grammar, n: int, positive_rate: Optional[float] = 0.5, oracle: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> Tuple[List[Tuple[Word, bool]],  List[Tuple[Word, bool]]]:
+    it = WordEnumerator(g).words_by_length()
     positives = [(next(it), True) for _ in range(floor(n * positive_rate))]
 
     # Error prevention
@@ -96,13 +462,32 @@ def balanced_cases(g: Grammar, n: int, positive_rate: Optional[float] = 0.5) ->
         max_size = len(word) - 1
         rest += 1
 
-    # CYK es muy caro para palabras grandes, se podría implementar la opción de facilitar un checker definido en python
-    negatives = set()
-    while len(negatives) <  ceil(n * (1 - positive_rate)):
-        word = choices(terminals, k=randint(1, max_size))
-        if not cyk(g, word):
-            negatives.add((tuple(word), False))
-    return positives, list(negatives)
+    return positives, negative_cases(g, ceil(n * (1 - positive_rate)), max_size, oracle)
+
+
+def negative_cases(g: Grammar, n: int, max_size: int, oracle: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> List[Tuple[Word, bool]]:
+    # n distinct words out of the language with uniform random length in [1, max_size], candidates are drawn in batches
+    # of equal length words and checked by the oracle (see oracles.py), CYK by default
+    accepts = oracle if oracle is not None else cyk_oracle(g)
+    alphabet = sorted(g.terminal)
+    rng = np.random.default_rng(getrandbits(64))
+    negatives = {}
+    while len(negatives) < n:
+        lengths, counts = np.unique(rng.integers(1, max_size + 1, size=max(n - len(negatives), 64)), return_counts=True)
+        for length, count in zip(lengths.tolist(), counts.tolist()):
+            words = rng.integers(0, len(alphabet), size=(count, length))
+            for word in words[~accepts(words)].tolist():
+                if len(negatives) < n:
+                    negatives[tuple(alphabet[a] for a in word), False] = None
+    return list(negatives)
+
+
+def stratified_sample(labels: List[bool], n: int, rng: random.Random = random) -> List[int]:
+    # Sorted indexes of n cases with the same proportion of positives as labels
+    positives = [i for i, p in enumerate(labels) if p]
+    negatives = [i for i, p in enumerate(labels) if not p]
+    n_positives = min(round(n * len(positives) / len(labels)), len(positives)) if labels else 0
+    return sorted(rng.sample(positives, n_positives) + rng.sample(negatives, min(n - n_positives, len(negatives))))
 
 
 def chunks(l: List[T], chunk_size: int) -> List[List[T]]:
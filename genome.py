@@ -1,9 +1,46 @@
 import random
+import numpy as np
 from copy import copy
-from typing import Set, List
+from typing import Set, List, Hashable, Tuple, Generator, Union, Optional
 
 
 Symbol = str
+Genome = np.ndarray
+# Third column of a terminal production in an array genome
+TERMINAL = -1
+
+
+def genome_key(gen: Union[List[Symbol], Genome]) -> Hashable:
+    # Array genomes encoding the same production set share the key, whatever their order or repeated productions
+    return canonical_codes(gen).tobytes() if isinstance(gen, np.ndarray) else tuple(gen)
+
+
+def canonical_codes(population: np.ndarray) -> np.ndarray:
+    # Canonical form of array genomes (..., n_productions, 3): one int32 code per production, sorted, with the
+    # repeated productions replaced by -1
+    rows = population.astype(np.int32) + 1
+    codes = np.sort((rows[..., 0] << 16) | (rows[..., 1] << 8) | rows[..., 2], axis=-1)
+    codes[..., 1:][codes[..., 1:] == codes[..., :-1]] = -1
+    return np.sort(codes, axis=-1)
+
+
+def derives_words(population: np.ndarray, s: int, n_non_terminal: int) -> np.ndarray:
+    # Whether the start symbol s of each array genome of the population derives some terminal word, computed as the
+    # fixed point of the productive non-terminals: the left sides of terminal productions and of binary productions
+    # with both right symbols productive
+    n_genomes = len(population)
+    left, binary = population[..., 0], population[..., 2] != TERMINAL
+    b, c = np.where(binary, population[..., 1], 0), np.where(binary, population[..., 2], 0)
+    productive = np.zeros((n_genomes, n_non_terminal), dtype=bool)
+    g, prod = np.nonzero(~binary)
+    productive[g, left[g, prod]] = True
+    for _ in range(n_non_terminal):
+        g, prod = np.nonzero(binary & np.take_along_axis(productive, b, axis=1) & np.take_along_axis(productive, c, axis=1)
+                             & ~np.take_along_axis(productive, left, axis=1))
+        if not len(g):
+            break
+        productive[g, left[g, prod]] = True
+    return productive[:, s]
 
 
 def split_gen(terminal: Set[Symbol], gen: List[Symbol]) -> List[List[Symbol]]:
@@ -19,18 +56,143 @@ def split_gen(terminal: Set[Symbol], gen: List[Symbol]) -> List[List[Symbol]]:
     return res
 
 
-def random_combination(terminal: Set[Symbol], a: List[Symbol], b: List[Symbol]) -> List[Symbol]:
+def productions_iterator(terminal: Set[Symbol], gen: List[Symbol]) -> Generator[Tuple[Symbol, Union[Tuple[Symbol], Tuple[Symbol, Symbol]]], None, None]:
+    # Same split as split_gen, without copying the genome
+    i = 0
+    while i < len(gen):
+        if gen[i+1] in terminal:
+            yield gen[i], (gen[i+1],)
+            i += 2
+        else:
+            yield gen[i], (gen[i+1], gen[i+2])
+            i += 3
+
+
+def random_combination(terminal: Set[Symbol], a: List[Symbol], b: List[Symbol], rng: random.Random = random) -> List[Symbol]:
     a_split, b_split = split_gen(terminal, a), split_gen(terminal, b)
-    index = random.randrange(0, min(len(a_split), len(b_split)))
+    index = rng.randrange(0, min(len(a_split), len(b_split)))
     return sum(a_split[:index] + b_split[index:], [])
 
 
-def random_simple_mutations(non_terminal: Set[Symbol], terminal: Set[Symbol], gen: List[Symbol], n_mutations: int = 1) -> List[Symbol]:
-    indexes = random.choices(list(range(len(gen))), k=n_mutations)
+def random_simple_mutations(non_terminal: Set[Symbol], terminal: Set[Symbol], gen: List[Symbol], n_mutations: int = 1, rng: random.Random = random) -> List[Symbol]:
+    # Alphabets are sorted so the result only depends on the rng state, not on the set order
+    indexes = rng.choices(list(range(len(gen))), k=n_mutations)
     res = copy(gen)
     for i in indexes:
         if res[i] in terminal:
-            res[i] = random.choice(list(terminal))
+            res[i] = rng.choice(sorted(terminal))
         else:
-            res[i] = random.choice(list(non_terminal))
-    return res
\ No newline at end of file
+            res[i] = rng.choice(sorted(non_terminal))
+    return res
+
+
+class GenomeCodec:
+    # Array genomes are int8 (n_productions, 3) arrays with a row per production: [A, B, C] for A -> BC and
+    # [A, a, TERMINAL] for A -> a, non-terminals and terminals are indexes in their sorted alphabets
+    def __init__(self, non_terminal: Set[Symbol], terminal: Set[Symbol]) -> None:
+        self.symbols: List[Symbol] = sorted(non_terminal)
+        self.alphabet: List[Symbol] = sorted(terminal)
+        self.index = {a: i for i, a in enumerate(self.symbols)}
+        self.t_index = {a: i for i, a in enumerate(self.alphabet)}
+
+    def encode(self, gen: List[Symbol]) -> Genome:
+        rows = [[self.index[a], self.t_index[bc[0]], TERMINAL] if len(bc) == 1 else [self.index[a], self.index[bc[0]], self.index[bc[1]]]
+                for a, bc in productions_iterator(set(self.t_index), gen)]
+        return np.array(rows, dtype=np.int8).reshape(-1, 3)
+
+    def productions(self, gen: Genome) -> Generator[Tuple[Symbol, Union[Tuple[Symbol], Tuple[Symbol, Symbol]]], None, None]:
+        for a, b, c in gen.tolist():
+            if c == TERMINAL:
+                yield self.symbols[a], (self.alphabet[b],)
+            else:
+                yield self.symbols[a], (self.symbols[b], self.symbols[c])
+
+    def decode(self, gen: Genome) -> List[Symbol]:
+        return [symbol for a, bc in self.productions(gen) for symbol in (a,) + bc]
+
+
+def crossovers(population: np.ndarray, n_crossovers: int, rng: np.random.Generator, parents: Optional[np.ndarray] = None) -> np.ndarray:
+    # Same operator as random_combination for every pair at once, the productions before the cut come from the first parent.
+    # The (n_crossovers, 2) parent indexes are drawn uniformly unless given
+    n_productions = population.shape[1]
+    if parents is None:
+        parents = rng.integers(0, len(population), size=(n_crossovers, 2))
+    cuts = rng.integers(0, n_productions, size=n_crossovers)
+    first = np.arange(n_productions)[None, :, None] < cuts[:, None, None]
+    return np.where(first, population[parents[:, 0]], population[parents[:, 1]])
+
+
+def mutations(population: np.ndarray, n_mutations: int, mutation_size_range: Tuple[int, int], n_non_terminal: int, n_terminal: int, rng: np.random.Generator,
+              parents: Optional[np.ndarray] = None) -> np.ndarray:
+    # Same operator as random_simple_mutations for every child at once, the changed positions are drawn with replacement
+    # among the symbols of the genome (the TERMINAL markers are not symbols). The parent indexes are drawn uniformly unless given
+    if parents is None:
+        parents = rng.integers(0, len(population), size=n_mutations)
+    children = population[parents].reshape(n_mutations, -1)
+    sizes = rng.integers(mutation_size_range[0], mutation_size_range[1] + 1, size=n_mutations)
+    max_size = int(sizes.max(initial=0))
+
+    is_terminal = np.repeat(children[:, 2::3] == TERMINAL, 3, axis=1) & (np.arange(children.shape[1]) % 3 != 0)
+    valid = children != TERMINAL
+    order = np.argsort(~valid, axis=1, kind='stable')
+    picks = (rng.random((n_mutations, max_size)) * valid.sum(axis=1, keepdims=True)).astype(np.intp)
+    positions = np.take_along_axis(order, picks, axis=1)
+
+    terminal_slot = np.take_along_axis(is_terminal, positions, axis=1)
+    values = (rng.random((n_mutations, max_size)) * np.where(terminal_slot, n_terminal, n_non_terminal)).astype(np.int8)
+    rows, cols = np.nonzero(np.arange(max_size)[None, :] < sizes[:, None])
+    children[rows, positions[rows, cols]] = values[rows, cols]
+    return children.reshape(n_mutations, *population.shape[1:])
+
+
+def offspring(population: np.ndarray, n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int], n_non_terminal: int, n_terminal: int, rng: np.random.Generator,
+              parents: Optional[np.ndarray] = None) -> np.ndarray:
+    # Every child of a train step in one pass, the mutated ones followed by the crossed ones. The n_mutations +
+    # 2 * n_crossovers parent indexes, those of the mutations first, are drawn uniformly unless given
+    return np.concatenate([mutations(population, n_mutations, mutation_size_range, n_non_terminal, n_terminal, rng, None if parents is None else parents[:n_mutations]),
+                           crossovers(population, n_crossovers, rng, None if parents is None else parents[n_mutations:].reshape(-1, 2))])
+
+
+class Population:
+    # Struct of arrays of the array genomes of a membrane along with the fitness of each one in the last evaluation and
+    # its age (train steps it survived). Every slot is evaluated on the cases of each train step, so all the fitness
+    # values come from the same evaluation and no per-slot evaluation stamp is needed. Slots keep their position,
+    # selection only partitions the fitness and the children replace the worst genomes in place
+    def __init__(self, genomes: np.ndarray) -> None:
+        self.genomes : np.ndarray = genomes
+        self.fitness : np.ndarray = np.zeros(len(genomes))
+        self.age : np.ndarray = np.zeros(len(genomes), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.genomes)
+
+    def evaluated(self, fitness: np.ndarray) -> None:
+        self.fitness[:] = fitness
+
+    def best(self) -> int:
+        # Slot of the best fitness, the first one on ties
+        return int(np.argmax(self.fitness))
+
+    def top(self, k: int) -> np.ndarray:
+        # Slots of the k best fitness values, in no particular order
+        if k >= len(self):
+            return np.arange(len(self))
+        return np.argpartition(-self.fitness, k)[:k] if k > 0 else np.zeros(0, dtype=np.intp)
+
+    def worst(self, k: int) -> np.ndarray:
+        # Slots of the k worst fitness values, in no particular order
+        if k >= len(self):
+            return np.arange(len(self))
+        return np.argpartition(self.fitness, k)[:k] if k > 0 else np.zeros(0, dtype=np.intp)
+
+    def tournament(self, n: int, size: int, rng: np.random.Generator) -> np.ndarray:
+        # n parent slots, each one the best of size slots drawn uniformly with replacement
+        candidates = rng.integers(0, len(self), size=(n, size))
+        return candidates[np.arange(n), np.argmax(self.fitness[candidates], axis=1)]
+
+    def replace(self, slots: np.ndarray, children: np.ndarray) -> None:
+        # Ages the survivors and puts the children in slots
+        self.age += 1
+        self.genomes[slots] = children
+        self.fitness[slots] = 0
+        self.age[slots] = 0
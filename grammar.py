@@ -2,11 +2,14 @@ from __future__ import annotations
 
 import json
 import heapq
+import random
+import numpy as np
 from random import choice
 from copy import deepcopy
-from genome import split_gen
-from collections import defaultdict
-from typing import Set, Dict, Union, Tuple, List, Generator, Optional
+from genome import split_gen, productions_iterator
+from itertools import islice, repeat
+from collections import defaultdict, OrderedDict
+from typing import Set, Dict, Union, Tuple, List, Generator, Optional, Iterable
 
 
 Symbol = str
@@ -25,6 +28,7 @@ class Grammar:
         self.terminal: Set[Symbol] = terminal
         self.productions: Productions = productions
         self.s: Symbol = s
+        self._compiled: Optional[CompiledGrammar] = None
 
     def __contains__(self, symbol: Symbol):
         return symbol in self.productions
@@ -51,19 +55,21 @@ class Grammar:
             return Grammar(set(data['Vn']), set(data['Vt']), prod, data['S'])
 
     @staticmethod
-    def random(non_terminal: Set[Symbol], terminal: Set[Symbol], s: Symbol, n_non_term_prod: int, n_term_prod: int) -> Grammar:
-        non_term, term = list(non_terminal), list(terminal)
+    def random(non_terminal: Set[Symbol], terminal: Set[Symbol], s: Symbol, n_non_term_prod: int, n_term_prod: int, rng: random.Random = random) -> Grammar:
+        non_term, term = sorted(non_terminal), sorted(terminal)
 
-        rules = set()
+        rules = []
         grammar = defaultdict(lambda: set())
 
         while len(rules) < n_non_term_prod:
-            rule = (choice(non_term), choice(non_term), choice(non_term))
-            rules.add(rule)
+            rule = (rng.choice(non_term), rng.choice(non_term), rng.choice(non_term))
+            if rule not in rules:
+                rules.append(rule)
 
         while len(rules) < n_non_term_prod + n_term_prod:
-            rule = (choice(non_term), choice(term))
-            rules.add(rule)
+            rule = (rng.choice(non_term), rng.choice(term))
+            if rule not in rules:
+                rules.append(rule)
 
         for rule in rules:
             grammar[rule[0]].add(tuple(list(rule)[1:]))
@@ -80,9 +86,9 @@ class Grammar:
     def serializable(self) -> dict:
         return {
             'S':  self.s,
-            'Vn': list(self.non_terminal),
-            'Vt': list(self.terminal),
-            'P':  {k: list(v) for k, v in self.productions.items()}
+            'Vn': sorted(self.non_terminal),
+            'Vt': sorted(self.terminal),
+            'P':  {k: sorted(v) for k, v in sorted(self.productions.items())}
         }
 
     def is_valid(self) -> bool:
@@ -163,7 +169,7 @@ class Grammar:
     def encoded(self) -> List[Symbol]:
         gen = []
         for a, p in self.productions.items():
-            for k in p:
+            for k in sorted(p):
                 gen.extend([a] + list(k))
         return gen
 
@@ -178,3 +184,254 @@ class Grammar:
         for k, v in self.productions.items():
             for prod in v:
                 yield k, prod
+
+    def compiled(self) -> CompiledGrammar:
+        if self._compiled is None:
+            self._compiled = CompiledGrammar(self.s, self.productions_iterator())
+        return self._compiled
+
+
+class CompiledGrammar:
+    # Immutable lookup tables for CYK, non-terminal sets are stored as integer bitmasks where bit i is symbols[i]
+    __slots__ = ('symbols', 's_mask', 'useful', 'terminal', 'binary', 'by_left', '_combinations')
+
+    def __init__(self, s: Symbol, productions: Iterable[Tuple[Symbol, Union[Tuple[Symbol], Tuple[Symbol, Symbol]]]]) -> None:
+        productions = list(productions)
+        symbols = tuple(sorted({a for a, _ in productions}))
+        index = {a: i for i, a in enumerate(symbols)}
+        s_mask = 1 << index[s] if s in index else 0
+
+        # terminal -> mask of the left sides producing it, (B, C) -> mask of the left sides producing BC
+        terminal = defaultdict(int)
+        binary = defaultdict(int)
+        for a, bc in productions:
+            if len(bc) == 1:
+                terminal[bc[0]] |= 1 << index[a]
+            elif len(bc) == 2 and bc[0] in index and bc[1] in index:
+                binary[index[bc[0]], index[bc[1]]] |= 1 << index[a]
+
+        # Inverted index by the first symbol of the right side, B -> [(C bit, left sides mask)]
+        by_left = [[] for _ in symbols]
+        for (b, c), a_mask in binary.items():
+            by_left[b].append((1 << c, a_mask))
+
+        # Mask of the non-terminals reachable from S, the only ones that can take part in a derivation of S
+        useful = s_mask
+        pending = [index[s]] if s_mask else []
+        while len(pending):
+            a_bit = 1 << pending.pop()
+            for (b, c), a_mask in binary.items():
+                if a_mask & a_bit:
+                    for symbol in (b, c):
+                        if not useful >> symbol & 1:
+                            useful |= 1 << symbol
+                            pending.append(symbol)
+
+        init = super().__setattr__
+        init('symbols', symbols)
+        init('s_mask', s_mask)
+        init('useful', useful)
+        init('terminal', dict(terminal))
+        init('binary', dict(binary))
+        init('by_left', tuple(tuple(prods) for prods in by_left))
+        init('_combinations', {})
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    @staticmethod
+    def decode(terminal: Set[Symbol], s: Symbol, gen: List[Symbol]) -> CompiledGrammar:
+        return CompiledGrammar(s, productions_iterator(terminal, gen))
+
+    def compiled(self) -> CompiledGrammar:
+        return self
+
+    def combine(self, left: int, right: int) -> int:
+        out = self._combinations.get((left, right))
+        if out is None:
+            out = 0
+            mask, b = left, 0
+            while mask:
+                if mask & 1:
+                    for c_bit, a_mask in self.by_left[b]:
+                        if right & c_bit:
+                            out |= a_mask
+                mask >>= 1
+                b += 1
+            self._combinations[left, right] = out
+        return out
+
+    def symbols_of(self, mask: int) -> Set[Symbol]:
+        return {a for i, a in enumerate(self.symbols) if mask >> i & 1}
+
+
+class WordEnumerator:
+    # Words of the language one length at a time, counts[a][n] is the number of derivation trees of the length n words
+    # of the non-terminal a, only the counts grow with the longest length asked for. Derivation trees are ranked by
+    # production (in sorted order) and then by the length of the left part; with an ambiguous grammar a word has several
+    # trees, so words are ranked and sampled by their own
+    def __init__(self, g: Grammar, cache_limit: Optional[int] = 2**12, cache_size: Optional[int] = 2**22) -> None:
+        self.s: Symbol = g.s
+        # Distinct words of the (non-terminal, length) pairs with at most cache_limit derivations, they remove most of
+        # the repeated words of ambiguous grammars while enumerating. Only cache_size symbols are kept, the pairs not
+        # used for the longest time are evicted and derived again if needed
+        self.cache_limit: int = cache_limit
+        self.cache_size: int = cache_size
+        self.cache: OrderedDict[Tuple[Symbol, int], List[Tuple[Symbol, ...]]] = OrderedDict()
+        self.cached: int = 0
+        self.filled: int = 1
+        self.terminal: Dict[Symbol, List[Symbol]] = defaultdict(list)
+        self.binary: Dict[Symbol, List[Tuple[Symbol, Symbol]]] = defaultdict(list)
+        for a, prods in g.productions.items():
+            for p in sorted(prods):
+                if len(p) == 1:
+                    self.terminal[a].append(p[0])
+                else:
+                    self.binary[a].append(p)
+        symbols = set(g.non_terminal) | set(g.productions) | {b for bcs in self.binary.values() for bc in bcs for b in bc}
+        self.counts: Dict[Symbol, List[int]] = {a: [0, len(self.terminal[a])] for a in symbols}
+
+    def count(self, n: int, a: Optional[Symbol] = None) -> int:
+        counts = self.counts
+        for length in range(len(counts[self.s]), n+1):
+            for b in counts:
+                counts[b].append(sum(counts[c][i] * counts[d][length-i] for c, d in self.binary[b] for i in range(1, length)))
+        return counts[self.s if a is None else a][n] if n > 0 else 0
+
+    def is_exhausted(self, n: int) -> bool:
+        # A word longer than n has a part of length in (n/2, n], so if no non-terminal derives those lengths there are
+        # no more words
+        self.count(n)
+        return n > 0 and not any(counts[length] for counts in self.counts.values() for length in range(n//2 + 1, n+1))
+
+    def word(self, n: int, k: int) -> Word:
+        # The k-th distinct word of length n in the order of words(n), the words before it are enumerated
+        if k >= 0:
+            for w in islice(self.words(n), k, None):
+                return w
+        raise IndexError(f'There are no {k+1} words of length {n}')
+
+    def tree_word(self, n: int, k: int) -> Word:
+        # The word of the k-th derivation tree of length n, 0 <= k < count(n)
+        if not 0 <= k < self.count(n):
+            raise IndexError(f'There are {self.count(n)} derivations of length {n}')
+        counts = self.counts
+        out = []
+        pending = [(self.s, n, k)]
+        while len(pending):
+            a, length, k = pending.pop()
+            if length == 1:
+                out.append(self.terminal[a][k])
+                continue
+            for b, c in self.binary[a]:
+                for i in range(1, length):
+                    size = counts[b][i] * counts[c][length-i]
+                    if k < size:
+                        break
+                    k -= size
+                else:
+                    continue
+                kb, kc = divmod(k, counts[c][length-i])
+                pending.append((c, length-i, kc))
+                pending.append((b, i, kb))
+                break
+        return out
+
+    def trees(self, w: Word) -> float:
+        # Number of derivation trees of w, a CYK chart of counts: chart[j-1, i, a] for the span of length j at i. Counts
+        # are clipped at 1e150 so no product overflows, sample never keeps a word with that many trees anyway
+        n = len(w)
+        if not n:
+            return 0
+        index = {a: i for i, a in enumerate(sorted(self.counts))}
+        rules = [(index[a], index[b], index[c]) for a, prods in self.binary.items() for b, c in prods]
+        chart = np.zeros((n, n, len(index)))
+        for a, terminals in self.terminal.items():
+            chart[0, :, index[a]] = [terminals.count(t) for t in w]
+        if rules:
+            left_index, right_index, produces = [r[1] for r in rules], [r[2] for r in rules], np.zeros((len(rules), len(index)))
+            produces[np.arange(len(rules)), [r[0] for r in rules]] = 1
+            with np.errstate(over='ignore'):
+                for j in range(2, n+1):
+                    m = n-j+1
+                    right = np.stack([chart[j-k-1, k:k+m] for k in range(1, j)])
+                    pairs = np.minimum((chart[:j-1, :m, left_index] * right[..., right_index]).sum(axis=0), 1e150)
+                    chart[j-1, :m] = np.minimum(pairs @ produces, 1e150)
+        return float(chart[n-1, 0, index[self.s]])
+
+    def sample(self, n: int, rng: random.Random = random, by_tree: Optional[bool] = False, max_draws: Optional[int] = 2**12) -> Optional[Word]:
+        # Uniform among the words of length n, None if there are none. A uniform derivation tree is kept with probability
+        # 1 / (trees of its word), so ambiguous words are not favoured. That takes count(n) / (words of length n) draws on
+        # average and a GrammarException is raised when they are expected to be more than max_draws (None for no limit),
+        # the mean of 1 / trees of the draws estimates the probability of keeping one. Very ambiguous grammars, as dyck
+        # beyond a few tens of symbols, can only be sampled by_tree: the word of a single uniform derivation tree
+        total = self.count(n)
+        if not total:
+            return None
+        if by_tree:
+            return self.tree_word(n, rng.randrange(total))
+        draws, kept = 0, 0.0
+        while max_draws is None or draws < max_draws:
+            w = self.tree_word(n, rng.randrange(total))
+            trees = self.trees(w)
+            if rng.random() * trees < 1:
+                return w
+            draws, kept = draws + 1, kept + 1 / trees
+            if max_draws is not None and draws >= 16 and kept / draws * max_draws < 1:
+                break
+        raise GrammarException(f'Words of length {n} take more than {max_draws} draws, the grammar is too ambiguous to sample them by word')
+
+    def _fill(self, n: int) -> None:
+        # Caches the words of the pairs up to length n with at most cache_limit derivations, shortest first, so the
+        # derivation of a pair finds its shorter parts already cached
+        for length in range(self.filled + 1, n + 1):
+            for a in self.counts:
+                if 0 < self.count(length, a) <= self.cache_limit:
+                    words = self.cache[a, length] = list(dict.fromkeys(self._derive(a, length)))
+                    self.cached += len(words) * length
+                    while self.cached > self.cache_size and len(self.cache) > 1:
+                        (_, m), evicted = self.cache.popitem(last=False)
+                        self.cached -= len(evicted) * m
+        self.filled = max(self.filled, n)
+
+    def _derive(self, a: Symbol, n: int) -> Generator[Tuple[Symbol, ...], None, None]:
+        # Depth-first over the sentential forms without recursion: the leftmost pending (non-terminal, length) of a form
+        # is replaced by each of its terminals, its cached words or its productions and splits, in that order. Every
+        # stack entry is the prefix derived so far, the pending pairs after the replaced one and the replacements left
+        counts, cache = self.counts, self.cache
+        stack = [((), (), iter([((), ((a, n),))]))]
+        while len(stack):
+            prefix, rest, options = stack[-1]
+            option = next(options, None)
+            if option is None:
+                stack.pop()
+                continue
+            part, head = option
+            form, pending = prefix + part, head + rest
+            if not pending:
+                yield form
+                continue
+            (b, m), rest = pending[0], pending[1:]
+            if m == 1:
+                options = [((t,), ()) for t in self.terminal[b]]
+            elif (b, m) in cache:
+                cache.move_to_end((b, m))
+                options = zip(cache[b, m], repeat(()))
+            else:
+                options = [((), ((c, i), (d, m-i))) for c, d in self.binary[b] for i in range(1, m) if counts[c][i] and counts[d][m-i]]
+            stack.append((form, rest, iter(options)))
+
+    def words(self, n: int) -> Generator[Word, None, None]:
+        # Distinct words of length n
+        seen = set()
+        self._fill(n)
+        for w in self.cache.get((self.s, n)) or (self._derive(self.s, n) if self.count(n) else []):
+            if w not in seen:
+                seen.add(w)
+                yield list(w)
+
+    def words_by_length(self, max_length: Optional[int] = None) -> Generator[Word, None, None]:
+        n = 1
+        while (max_length is None or n < max_length) and not self.is_exhausted(n - 1):
+            yield from self.words(n)
+            n += 1
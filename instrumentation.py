@@ -0,0 +1,61 @@
+from time import perf_counter
+from contextlib import contextmanager
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Iterator
+
+
+class Stopwatch:
+    # Wall time per phase, accumulated in times while enabled: with watch('phase'): ...
+    # Nested phases are also included in the time of the outer ones
+    def __init__(self, enabled: Optional[bool] = False) -> None:
+        self.enabled : bool = enabled
+        self.times : Dict[str, float] = defaultdict(float)
+        self.phase : Optional[str] = None
+        self.running : List[Tuple[str, float]] = []
+
+    def __call__(self, phase: str) -> 'Stopwatch':
+        self.phase = phase
+        return self
+
+    def __enter__(self) -> None:
+        if self.enabled:
+            self.running.append((self.phase, perf_counter()))
+
+    def __exit__(self, *exc) -> None:
+        if self.enabled:
+            phase, start = self.running.pop()
+            self.times[phase] += perf_counter() - start
+
+    def reset(self) -> None:
+        self.times.clear()
+
+
+class Counters:
+    # Event counts of this process, the hot paths only update them while enabled
+    def __init__(self) -> None:
+        self.enabled : bool = False
+        self.counts : Dict[str, int] = defaultdict(int)
+
+    def add(self, key: str, n: int) -> None:
+        self.counts[key] += n
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.counts)
+
+    def since(self, snapshot: Dict[str, int]) -> Dict[str, int]:
+        return {k: v - snapshot.get(k, 0) for k, v in self.counts.items() if v != snapshot.get(k, 0)}
+
+    @contextmanager
+    def enable(self, enabled: Optional[bool] = True) -> Iterator[None]:
+        # Enabled inside the block if enabled (or already enabled), the previous state is restored after it
+        previous = self.enabled
+        self.enabled = previous or enabled
+        try:
+            yield
+        finally:
+            self.enabled = previous
+
+
+# CYK work: 'cyk_words' parsed words, 'cyk_cells' filled chart cells and 'substring_hits' / 'substring_misses' spans
+# found or not in the substring memo
+counters = Counters()
@@ -1,33 +1,43 @@
 import os
 import time
+import cProfile
 import argparse
 
 from tissue import Tissue
+from remote import Coordinator, remote_worker, parse_address, is_loopback, new_authkey
+from stopping import EarlyStopping
 from grammar import Grammar
-from fitness import balanced_cases
+from fitness import CaseBatch, CaseChunks, BatchScheduler, balanced_cases, stratified_sample
+from corpus import Corpus, CaseView, is_corpus
 
 import json
-from math import ceil, floor
+import numpy as np
 from tqdm import trange
 from copy import deepcopy
-from random import shuffle
+from random import shuffle, seed, getrandbits, getstate, setstate, Random
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import matplotlib.pyplot as plt
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Set, Generator, Union, Sequence
 
 from tools.cases_builder import build_cases
 from tools.experiments_visualization import visualize_experiment
 from tools.latex_generator import generate_latex
+from tools.results import read_records
+from tools.benchmark import run_benchmarks, compare
 
 Symbol = str
 Word = List[Symbol]
 
 
-def build_tissue(n_non_term_sym: int, n_terminal_sym: int, n_non_term_prod: int, n_terminal_prod: int, n_grammars: int, n_cells: int) -> Tissue:
+def build_tissue(n_non_term_sym: int, n_terminal_sym: int, n_non_term_prod: int, n_terminal_prod: int, n_grammars: int, n_cells: int, n_workers: Optional[int] = 0, evaluator: Optional[str] = 'genome', archive_size: Optional[int] = 256,
+                 instrument: Optional[bool] = False, coordinator: Optional[Coordinator] = None, tournament_size: Optional[int] = None) -> Tissue:
     non_terminal = {chr(ord('A') + i) for i in range(n_non_term_sym)}.union({'S'})
     if len(non_terminal) < n_non_term_sym:
         non_terminal.add(chr(ord(max(non_terminal))+1))
     terminal = {chr(ord('a') + i) for i in range(n_terminal_sym)}
-    return Tissue(non_terminal, terminal, 'S', n_non_term_prod, n_terminal_prod, n_cells, n_grammars)
+    return Tissue(non_terminal, terminal, 'S', n_non_term_prod, n_terminal_prod, n_cells, n_grammars, n_workers=n_workers, evaluator=evaluator, archive_size=archive_size, instrument=instrument,
+                  coordinator=coordinator, tournament_size=tournament_size)
 
 
 def make_cases(grammar: Grammar, n_cases: int, positive_rate: float, train_rate: float) -> Tuple[List[Tuple[Word, bool]], List[Tuple[Word, bool]]]:
@@ -38,7 +48,14 @@ def make_cases(grammar: Grammar, n_cases: int, positive_rate: float, train_rate:
     return cases[:train_i], cases[train_i:]
 
 
-def load_cases(path: str) -> List[Tuple[Word, bool]]:
+def load_cases(path: str) -> Union[List[Tuple[Word, bool]], CaseView]:
+    # Binary corpora are memory-mapped and only their shuffled order is kept in memory, the shuffle consumes the random
+    # state as with a json file of the same cases
+    if is_corpus(path):
+        corpus = Corpus(path)
+        order = list(range(len(corpus)))
+        shuffle(order)
+        return corpus.view(np.array(order, dtype=np.int64))
     with open(path, 'r') as f:
         data = json.load(f)
         cases = [(w, True) for w in data['positive']] + [(w, False) for w in data['negative']]
@@ -46,22 +63,69 @@ def load_cases(path: str) -> List[Tuple[Word, bool]]:
         return cases
 
 
-def train_and_test(tissue: Tissue, train_cases: List[Tuple[Word, bool]], test_cases: List[Tuple[Word, bool]],
+def train_and_test(tissue: Tissue, train_cases: Sequence[Tuple[Word, bool]], test_cases: Sequence[Tuple[Word, bool]],
                    n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int], mutate_out: Optional[bool] = False,
                    epochs: Optional[int] = 1, batch_size: Optional[int] = 1, shuffle_epochs: Optional[bool] = False,
-                   enable_trace: Optional[bool] = False, verb: Optional[bool] = False) -> Tuple[Grammar, float, List[float]]:
-    n_batches = ceil(len(train_cases)/batch_size)
+                   enable_trace: Optional[bool] = False, verb: Optional[bool] = False,
+                   checkpoint: Optional[str] = None, checkpoint_every: Optional[int] = 0,
+                   trace_every: Optional[int] = 1, trace_sample: Optional[int] = None,
+                   stopping: Optional[EarlyStopping] = None, reference_size: Optional[int] = 64) -> Tuple[Grammar, float, List[float], dict]:
+    # With a checkpoint path the tissue is saved every checkpoint_every batches and training resumes from it if it exists.
+    # Cases can be corpus views, the batches are decoded as they are used and the test cases in chunks when scored.
+    # The trace gets the test fitness every trace_every batches, on a fixed stratified sample of trace_sample test cases
+    # if given, only the genomes archived since the previous point are scored.
+    # Training ends early when stopping says so, the stop reason and the number of steps are returned along the result.
+    # Every batch is encoded once into a CaseBatch shared by all the membranes, the test cases into one per chunk.
+    # The out membrane ranks its genomes on a fixed stratified sample of reference_size training cases
+    stopping = EarlyStopping() if stopping is None else stopping
+    reason = 'completed'
+    alphabet = sorted(tissue.terminal)
+    scheduler = BatchScheduler(train_cases, alphabet, batch_size)
+    n_batches = len(scheduler)
     trace = []
-    for _ in trange(1, epochs + 1) if verb else range(1, epochs + 1):
-        if shuffle_epochs: shuffle(train_cases)
-        for i in trange(n_batches, leave=False) if verb else range(n_batches):
-            tissue.train_step(train_cases[i*batch_size:(i+1)*batch_size], n_crossovers, n_mutations, mutation_size_range, mutate_out=mutate_out)
-            if enable_trace:
-                trace.append(tissue.best(test_cases)[1])
+    order = list(range(len(train_cases)))
+    start_epoch, start_batch = 1, 0
+    train_labels = train_cases.labels() if isinstance(train_cases, CaseView) else [p for _, p in train_cases]
+    tissue.set_reference(CaseBatch([train_cases[j] for j in stratified_sample(train_labels, reference_size, Random(0))], alphabet))
+    if checkpoint is not None and os.path.isfile(checkpoint):
+        cursor = tissue.load(checkpoint)
+        start_epoch, start_batch, order, trace = cursor['epoch'], cursor['batch'], cursor['order'], cursor['trace']
+        if 'stopping' in cursor: stopping.restore(cursor['stopping'])
+        setstate((cursor['random'][0], tuple(cursor['random'][1]), cursor['random'][2]))
+
+    test_chunks = CaseChunks(test_cases, alphabet)
+    if enable_trace:
+        if trace_sample is not None and trace_sample < len(test_cases):
+            labels = test_cases.labels() if isinstance(test_cases, CaseView) else [p for _, p in test_cases]
+            trace_cases = CaseBatch([test_cases[j] for j in stratified_sample(labels, trace_sample, Random(0))], alphabet)
+        else:
+            trace_cases = test_chunks
+    steps = 0
+    for epoch in trange(start_epoch, epochs + 1) if verb else range(start_epoch, epochs + 1):
+        first = start_batch if epoch == start_epoch else 0
+        if shuffle_epochs and first == 0: shuffle(order)
+        batches = trange(first, n_batches, leave=False) if verb else range(first, n_batches)
+        for i in batches:
+            batch = scheduler.batch(order, i)
+            tissue.train_step(batch, n_crossovers, n_mutations, mutation_size_range, mutate_out=mutate_out)
+            if verb: batches.set_postfix(duplicates=f'{tissue.duplicate_ratio():.2f}', saved=tissue.saved_evaluations())
+            if enable_trace and ((epoch - 1) * n_batches + i + 1) % trace_every == 0:
+                trace.append(tissue.best(trace_cases)[1])
+            if (stop := stopping.update(tissue, train_cases)) is not None:
+                reason = stop
+                break
+
+            steps += 1
+            if checkpoint is not None and checkpoint_every and steps % checkpoint_every == 0:
+                next_epoch, next_batch = (epoch, i + 1) if i + 1 < n_batches else (epoch + 1, 0)
+                tissue.save(checkpoint, {'epoch': next_epoch, 'batch': next_batch, 'order': order, 'trace': trace, 'random': getstate(),
+                                         'stopping': stopping.state()})
+        if reason != 'completed':
+            break
 
     if verb: print('Testing and scoring')
-    best, fit = tissue.best(test_cases)
-    return best, fit, trace
+    best, fit = tissue.best(test_chunks)
+    return best, fit, trace, {'stop_reason': reason, 'steps': stopping.steps}
 
 
 def combinations(src: dict) -> List[dict]:
@@ -99,7 +163,7 @@ def run_exp_original(path: str, cases_path: str, verb: Optional[bool] = False, e
                 train_cases, test_cases = cases[:int(cases_size * 0.5)], cases[int(cases_size * 0.5):]
 
                 if verb: print('Starting train')
-                best, fit, trace = train_and_test(tissue, train_cases, test_cases, params['n_crossovers'], params['n_mutations'],
+                best, fit, trace, _ = train_and_test(tissue, train_cases, test_cases, params['n_crossovers'], params['n_mutations'],
                                                   params['mutation_size_range'],
                                                   params['mutate_out'], params['epochs'], params['batch_size'], params['shuffle_epochs'], enable_trace, verb)
 
@@ -118,58 +182,184 @@ def run_exp_original(path: str, cases_path: str, verb: Optional[bool] = False, e
 
 
 
-def run_exp(path: str, cases_path: str, verb: Optional[bool] = False, enable_trace: Optional[bool] = False, repetitions: Optional[int] = 1) -> List[dict]:
-    out = []
-    cases = load_cases(cases_path)
-    with open(path, 'r') as f:
-        data = json.load(f)
-        for _ in range(repetitions):
-            for basic_params in combinations(data):
-                print(basic_params)
-                if verb: print('Loading cases')
-                size = basic_params['samples_size']
-                for i in range(len(cases) // size):
-                    params = deepcopy(basic_params)
-                    train_cases = cases[i * size: (i + 1) * size]
-                    test_cases = cases[:i * size] + cases[(i + 1) * size:]
-                    if verb: print(f'Parameters: {params}')
-                    out.append({'params': deepcopy(params)})
-                    #params['grammar'] = Grammar.load(params['grammar'])
-                    params['mutation_size_range'] = (params['mutation_size_min'], params['mutation_size_max'])
-
-                    if verb: print('Generating grammars')
-                    tissue = build_tissue(params['n_non_term_sym'], params['n_terminal_sym'], params['n_non_term_prod'], params['n_terminal_prod'], params['n_grammars'], params['n_cells'])
-
-
-                    if verb: print('Starting train')
-                    best, fit, trace = train_and_test(tissue, train_cases, test_cases, params['n_crossovers'], params['n_mutations'],
-                                                      params['mutation_size_range'],
-                                                      params['mutate_out'], params['epochs'], params['batch_size'], params['shuffle_epochs'], enable_trace, verb)
-
-                    if enable_trace: out[-1]['trace'] = trace
-                    out[-1]['fitness'] = fit
-                    out[-1]['result'] = best.serializable()
-                    if verb:
-                        print('\nBest grammar:')
-                        print(f'Score {fit}')
-                        print(best)
-
-                    if enable_trace:
-                        plt.plot(trace)
-                        plt.show()
+def experiment_tasks(data: dict, n_cases: int, repetitions: int, seed: Optional[int] = None) -> List[Tuple[dict, int, int]]:
+    # One (params, fold, seed) task per run, the seeds only depend on the task position
+    rng = Random(seed)
+    tasks = []
+    for _ in range(repetitions):
+        for basic_params in combinations(data):
+            for i in range(n_cases // basic_params['samples_size']):
+                tasks.append((basic_params, i, rng.getrandbits(64)))
+    return tasks
+
+
+experiment_cases: Sequence[Tuple[Word, bool]] = []
+
+
+def init_experiment_worker(cases: Sequence[Tuple[Word, bool]]) -> None:
+    global experiment_cases
+    experiment_cases = cases
+
+
+def run_task(task: Tuple[dict, int, int], verb: Optional[bool] = False, enable_trace: Optional[bool] = False, workers: Optional[int] = 0,
+             checkpoint: Optional[str] = None, checkpoint_every: Optional[int] = 0, instrument: Optional[bool] = False, profile: Optional[str] = None,
+             trace_every: Optional[int] = 1, trace_sample: Optional[int] = None, coordinator: Optional[Coordinator] = None) -> dict:
+    # With instrument the result gets the instrumentation of the tissue, with a profile path the run is profiled with
+    # cProfile (only this process, not the membrane workers) and the stats are dumped there. With a coordinator the
+    # membranes run on its remote workers
+    basic_params, i, task_seed = task
+    seed(task_seed)
+    cases = experiment_cases
+    if i == 0: print(basic_params)
+
+    params = deepcopy(basic_params)
+    size = params['samples_size']
+    train_cases = cases[i * size: (i + 1) * size]
+    test_cases = cases[:i * size] + cases[(i + 1) * size:]
+    if verb: print(f'Parameters: {params}')
+    out = {'params': deepcopy(params)}
+    #params['grammar'] = Grammar.load(params['grammar'])
+    params['mutation_size_range'] = (params['mutation_size_min'], params['mutation_size_max'])
+
+    if verb: print('Generating grammars')
+    tissue = build_tissue(params['n_non_term_sym'], params['n_terminal_sym'], params['n_non_term_prod'], params['n_terminal_prod'], params['n_grammars'], params['n_cells'], workers,
+                          params.get('evaluator', 'genome'), params.get('archive_size', 256), instrument, coordinator, params.get('tournament_size'))
+
+    if verb: print('Starting train')
+    profiler = cProfile.Profile() if profile is not None else None
+    if profiler is not None: profiler.enable()
+    try:
+        stopping = EarlyStopping(params.get('stop_on_perfect', False), params.get('patience'), params.get('max_seconds'), params.get('max_evaluations'))
+        best, fit, trace, stop = train_and_test(tissue, train_cases, test_cases, params['n_crossovers'], params['n_mutations'],
+                                          params['mutation_size_range'],
+                                          params['mutate_out'], params['epochs'], params['batch_size'], params['shuffle_epochs'], enable_trace, verb,
+                                          checkpoint, checkpoint_every, trace_every, trace_sample, stopping, params.get('archive_sample', 64))
+    finally:
+        tissue.close()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+    if checkpoint is not None and os.path.isfile(checkpoint):
+        os.remove(checkpoint)
+
+    if enable_trace:
+        out['trace'] = trace
+        out['trace_every'] = trace_every
+    if instrument: out['instrumentation'] = tissue.instrumentation()
+    out.update(stop)
+    out['fitness'] = fit
+    out['result'] = best.serializable()
+    if verb:
+        print('\nBest grammar:')
+        print(f'Score {fit}')
+        print(best)
     return out
 
 
-def experiment_main(exp_path: str, cases_path: str, out_path: str, verb: bool, repetitions: int) -> None:
-    enable_trace = False
-
-    out = run_exp(exp_path, cases_path, verb, enable_trace, repetitions=repetitions)
-    with open(out_path, 'w') as f:
-        json.dump({
-            'cases_path': os.path.realpath(cases_path),
-            'experiment_path': os.path.realpath(exp_path),
-            'results': out
-        }, f, indent=4)
+def run_exp(path: str, cases_path: str, verb: Optional[bool] = False, enable_trace: Optional[bool] = False, repetitions: Optional[int] = 1,
+            workers: Optional[int] = 0, jobs: Optional[int] = 1, exp_seed: Optional[int] = None, done: Optional[Set[int]] = None,
+            checkpoint_dir: Optional[str] = None, checkpoint_every: Optional[int] = 0, instrument: Optional[bool] = False,
+            profile_dir: Optional[str] = None, trace_every: Optional[int] = 1, trace_sample: Optional[int] = None,
+            coordinator: Optional[Coordinator] = None) -> Generator[Tuple[int, dict], None, None]:
+    # Yields (task index, result) as the runs finish, the tasks in done are skipped
+    if exp_seed is not None: seed(exp_seed)
+    cases = load_cases(cases_path)
+    with open(path, 'r') as f:
+        data = json.load(f)
+    tasks = [(i, task) for i, task in enumerate(experiment_tasks(data, len(cases), repetitions, exp_seed)) if done is None or i not in done]
+
+    run = partial(run_task, verb=verb, enable_trace=enable_trace, workers=workers, checkpoint_every=checkpoint_every, instrument=instrument,
+                  trace_every=trace_every, trace_sample=trace_sample)
+    for directory in (checkpoint_dir, profile_dir):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+    checkpoints = {i: None if checkpoint_dir is None else os.path.join(checkpoint_dir, f'task_{i}.npz') for i, _ in tasks}
+    profiles = {i: None if profile_dir is None else os.path.join(profile_dir, f'task_{i}.prof') for i, _ in tasks}
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_experiment_worker, initargs=(cases,)) as executor:
+            futures = {executor.submit(run, task, checkpoint=checkpoints[i], profile=profiles[i]): i for i, task in tasks}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+    else:
+        init_experiment_worker(cases)
+        for i, task in tasks:
+            yield i, run(task, checkpoint=checkpoints[i], profile=profiles[i], coordinator=coordinator)
+
+
+def ends_with_newline(path: str) -> bool:
+    with open(path, 'rb') as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def experiment_main(exp_path: str, cases_path: str, out_path: str, verb: bool, repetitions: int, workers: int, jobs: int, exp_seed: Optional[int],
+                    resume: Optional[bool] = False, checkpoint_dir: Optional[str] = None, checkpoint_every: Optional[int] = 0,
+                    instrument: Optional[bool] = False, profile_dir: Optional[str] = None,
+                    enable_trace: Optional[bool] = False, trace_every: Optional[int] = 1, trace_sample: Optional[int] = None,
+                    listen: Optional[str] = None, authkey: Optional[str] = None, remote_workers: Optional[int] = 0,
+                    remote_timeout: Optional[float] = None) -> None:
+
+    # Streamed results: a header line and then one line per finished run, so a killed experiment can be resumed
+    header = {
+        'cases_path': os.path.realpath(cases_path),
+        'experiment_path': os.path.realpath(exp_path),
+        'repetitions': repetitions,
+        'seed': getrandbits(64) if exp_seed is None else exp_seed
+    }
+    done = set()
+    previous = []
+    if resume and os.path.isfile(out_path):
+        with open(out_path, 'r') as f:
+            previous = read_records(f)
+    if previous:
+        if any(previous[0].get(k) != header[k] for k in ('cases_path', 'experiment_path', 'repetitions')):
+            print(f'Error: {out_path} was generated with a different experiment, cases or repetitions')
+            return
+        if exp_seed is not None and exp_seed != previous[0]['seed']:
+            print(f'Error: {out_path} was generated with seed {previous[0]["seed"]}')
+            return
+        header['seed'] = previous[0]['seed']
+        done = {record['task'] for record in previous[1:]}
+
+    if not previous and checkpoint_dir is not None and os.path.isdir(checkpoint_dir):
+        # Snapshots of an older experiment must not be resumed by this one
+        for file in os.listdir(checkpoint_dir):
+            if file.startswith('task_') and file.endswith('.npz'):
+                os.remove(os.path.join(checkpoint_dir, file))
+
+    coordinator = None
+    if listen is not None:
+        if jobs > 1:
+            print('Error: remote workers (--listen) can only be used with one job')
+            return
+        # Connections unpickle what they receive, so anyone with the key can run code on the coordinator and the workers.
+        # Without a key only loopback addresses are allowed, with a random key the workers have to be given
+        if authkey is None:
+            if not is_loopback(parse_address(listen)[0]):
+                print('Error: --listen on a non-loopback address needs an explicit --authkey')
+                return
+            authkey = new_authkey()
+            print(f'Remote workers key: {authkey}')
+        # The same coordinator, and so the same workers, runs the membranes of every run
+        coordinator = Coordinator(parse_address(listen), authkey.encode(), remote_timeout)
+        if verb: print(f'Waiting for {remote_workers} workers at {listen}')
+        coordinator.wait_workers(remote_workers)
+
+    with open(out_path, 'a' if previous else 'w') as f:
+        if not previous:
+            f.write(json.dumps(header) + '\n')
+        elif not ends_with_newline(out_path):
+            f.write('\n')
+        for i, result in run_exp(exp_path, cases_path, verb, enable_trace, repetitions=repetitions, workers=workers, jobs=jobs, exp_seed=header['seed'], done=done,
+                                 checkpoint_dir=checkpoint_dir, checkpoint_every=checkpoint_every, instrument=instrument, profile_dir=profile_dir,
+                                 trace_every=trace_every, trace_sample=trace_sample, coordinator=coordinator):
+            f.write(json.dumps({'task': i, **result}) + '\n')
+            f.flush()
+    if coordinator is not None:
+        if verb: print(f'Remote workers: {coordinator.stats}')
+        coordinator.close()
 
 
 def main() -> None:
@@ -183,14 +373,44 @@ def main() -> None:
     parser_cbuilder.add_argument('positives', type=int, help='number of positive cases')
     parser_cbuilder.add_argument('negatives', type=int, help='number of negative cases')
     parser_cbuilder.add_argument('out', help='path to the output cases file (json)')
+    parser_cbuilder.add_argument('-b', '--binary', action='store_true', help='write a memory-mapped binary corpus instead of json, exp reads both')
 
     # Subparser for experiments
     parser_experiment = subparsers.add_parser('exp')
     parser_experiment.add_argument('experiment', help='experiment to be run (json)')
-    parser_experiment.add_argument('cases', help='cases file (json) to use in the experiment')
-    parser_experiment.add_argument('out', help='path to the output results file (json)')
+    parser_experiment.add_argument('cases', help='cases file (json or binary corpus) to use in the experiment')
+    parser_experiment.add_argument('out', help='path to the output results file (jsonl, one line per run)')
     parser_experiment.add_argument('-v', '--verbose', action='store_true', help='increase verbosity')
     parser_experiment.add_argument('-r', '--repetitions', type=int, default=1, help='number of times the experiment is repeated (default 1)')
+    parser_experiment.add_argument('-j', '--jobs', type=int, default=1, help='number of experiment runs executed in parallel (default 1)')
+    parser_experiment.add_argument('-s', '--seed', type=int, default=None, help='seed of the experiment, makes the results reproducible')
+    parser_experiment.add_argument('--resume', action='store_true', help='skip the runs already written to the output file')
+    parser_experiment.add_argument('--checkpoint-dir', default=None, help='directory for the snapshots of the running tissues, used by --resume')
+    parser_experiment.add_argument('--checkpoint-every', type=int, default=100, help='number of batches between tissue snapshots (default 100)')
+    parser_experiment.add_argument('--trace', action='store_true', help='add the test fitness of the best grammar along the training to every result')
+    parser_experiment.add_argument('--trace-every', type=int, default=1, help='number of batches between trace points (default 1)')
+    parser_experiment.add_argument('--trace-sample', type=int, default=None, help='number of test cases, stratified by label, used for the trace (default all)')
+    parser_experiment.add_argument('--instrument', action='store_true', help='add phase times, CYK work and cache hit rates to every result')
+    parser_experiment.add_argument('--profile', default=None, help='directory for a cProfile dump of every run (task_<i>.prof)')
+    parser_experiment.add_argument('-w', '--workers', type=int, default=0, help='number of worker processes running the membranes of each tissue (default 0, sequential)')
+    parser_experiment.add_argument('--listen', default=None, help='host:port where remote workers (worker subcommand) connect to run the membranes')
+    parser_experiment.add_argument('--remote-workers', type=int, default=0, help='number of remote workers to wait for before starting (default 0)')
+    parser_experiment.add_argument('--remote-timeout', type=float, default=None, help='seconds before the membranes of a slow worker are run elsewhere (default wait)')
+    parser_experiment.add_argument('--authkey', default=None, help='shared key of the coordinator and the remote workers, required with a non-loopback --listen (default random, printed)')
+
+    # Subparser for remote workers
+    parser_worker = subparsers.add_parser('worker')
+    parser_worker.add_argument('address', help='host:port of the coordinator (exp --listen)')
+    parser_worker.add_argument('--authkey', required=True, help='shared key of the coordinator and the remote workers')
+    parser_worker.add_argument('--retry', type=float, default=30, help='seconds trying to connect to the coordinator (default 30)')
+
+    # Subparser for benchmarks
+    parser_bench = subparsers.add_parser('bench')
+    parser_bench.add_argument('out', help='path to the output benchmark results file (json)')
+    parser_bench.add_argument('-c', '--compare', default=None, help='previous benchmark results file (json), exits with an error if any benchmark regressed')
+    parser_bench.add_argument('-t', '--threshold', type=float, default=0.1, help='relative slowdown flagged as a regression (default 0.1)')
+    parser_bench.add_argument('-r', '--repeat', type=int, default=5, help='timed runs of each benchmark (default 5)')
+    parser_bench.add_argument('-k', '--filter', default=None, help='only run the benchmarks whose name contains this text')
 
     # Subparser for results visualizer
     parser_visualizer = subparsers.add_parser('plot')
@@ -207,9 +427,18 @@ def main() -> None:
     config = vars(args)
 
     if config['subcommand'] == 'cbuilder':
-        build_cases(config['positives'], config['negatives'], config['grammar'], config['out'])
+        build_cases(config['positives'], config['negatives'], config['grammar'], config['out'], config['binary'])
     elif config['subcommand'] == 'exp':
-        experiment_main(config['experiment'], config['cases'], config['out'], config['verbose'], config['repetitions'])
+        experiment_main(config['experiment'], config['cases'], config['out'], config['verbose'], config['repetitions'], config['workers'], config['jobs'], config['seed'], config['resume'],
+                        config['checkpoint_dir'], config['checkpoint_every'], config['instrument'], config['profile'],
+                        config['trace'], config['trace_every'], config['trace_sample'],
+                        config['listen'], config['authkey'], config['remote_workers'], config['remote_timeout'])
+    elif config['subcommand'] == 'worker':
+        remote_worker(parse_address(config['address']), config['authkey'].encode(), config['retry'])
+    elif config['subcommand'] == 'bench':
+        report = run_benchmarks(config['out'], config['repeat'], config['filter'])
+        if config['compare'] is not None and compare(report, config['compare'], config['threshold']):
+            exit(1)
     elif config['subcommand'] == 'plot':
         visualize_experiment(config['file'], config['mode'])
     elif config['subcommand'] == 'latex':
@@ -0,0 +1,48 @@
+import numpy as np
+from typing import Dict, Callable, Optional
+
+from grammar import Grammar
+from fitness import cyk_oracle
+
+
+# Membership oracles take a (batch, n) stack of equal-length words, encoded as indexes in the sorted alphabet, and
+# return a boolean mask with the words of the language
+Oracle = Callable[[np.ndarray], np.ndarray]
+
+
+def anbn(words: np.ndarray) -> np.ndarray:
+    n = words.shape[1]
+    if n == 0 or n % 2:
+        return np.zeros(len(words), dtype=bool)
+    return (words[:, :n//2] == 0).all(axis=1) & (words[:, n//2:] == 1).all(axis=1)
+
+
+def dyck(words: np.ndarray) -> np.ndarray:
+    # a opens and b closes
+    if words.shape[1] == 0:
+        return np.zeros(len(words), dtype=bool)
+    depth = np.cumsum(np.where(words == 0, 1, -1), axis=1)
+    return (words < 2).all(axis=1) & (depth.min(axis=1) >= 0) & (depth[:, -1] == 0)
+
+
+def wwr(words: np.ndarray) -> np.ndarray:
+    n = words.shape[1]
+    if n == 0 or n % 2:
+        return np.zeros(len(words), dtype=bool)
+    return (words < 2).all(axis=1) & (words == words[:, ::-1]).all(axis=1)
+
+
+ORACLES: Dict[str, Oracle] = {
+    'anbn': anbn,
+    'dyck': dyck,
+    'wwr':  wwr,
+}
+
+
+def get_oracle(g: Grammar, name: Optional[str] = None) -> Oracle:
+    # The "oracle" key of the grammar file selects the oracle, grammars without one are checked with CYK
+    if name is None:
+        return cyk_oracle(g)
+    if name not in ORACLES:
+        raise ValueError(f'Unknown oracle "{name}", available: {", ".join(sorted(ORACLES))}')
+    return ORACLES[name]
@@ -0,0 +1,294 @@
+import os
+import time
+import socket
+import secrets
+import threading
+import ipaddress
+from math import ceil
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, Connection, wait, deliver_challenge, answer_challenge
+from typing import Dict, List, Optional, Set, Tuple
+
+from tissue import Membrane
+from genome import Genome
+from fitness import CaseBatch
+
+
+Symbol = str
+Word = List[Symbol]
+Address = Tuple[str, int]
+
+
+def parse_address(address: str) -> Address:
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def new_authkey() -> str:
+    return secrets.token_hex(16)
+
+
+def connect(address: Address, authkey: bytes, retry: float) -> Connection:
+    # Retries for retry seconds, so workers can be started before the coordinator
+    deadline = time.monotonic() + retry
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except (ConnectionRefusedError, ConnectionResetError, FileNotFoundError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def remote_worker(address: Address, authkey: bytes, retry: Optional[float] = 30) -> None:
+    # Runs the membrane tasks sent by a coordinator until it closes the connection. The membranes are kept between steps
+    # to reuse their fitness caches, but each task brings the population (genome.Population) and rng state to start from
+    conn = connect(address, authkey, retry)
+    membranes : Dict[int, Membrane] = {}
+    args = None
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == 'close':
+                return
+            if message[0] == 'cases':
+                args = message[2]
+                continue
+            _, step, cell, membrane, population, state = message
+            if membrane is not None:
+                membranes[cell] = membrane
+            membrane = membranes[cell]
+            membrane.population = population
+            membrane.random.bit_generator.state = state
+            best = membrane.train_step(*args)
+            try:
+                conn.send((step, cell, best, membrane.stats, membrane.population, membrane.random.bit_generator.state))
+            except OSError:
+                return
+    finally:
+        conn.close()
+
+
+class RemoteWorker:
+    def __init__(self, conn: Connection) -> None:
+        self.conn : Connection = conn
+        # Cells whose membrane this worker already holds, (step, cell) tasks sent and not answered yet and last step
+        # whose cases were sent
+        self.cells : Set[int] = set()
+        self.pending : Set[Tuple[int, int]] = set()
+        self.step : int = 0
+
+
+class Coordinator:
+    # Runs the membranes of a tissue on remote_worker processes connected over TCP, workers can join at any time. Every
+    # task carries the population and rng state of its membrane and the result brings them back, so the membranes of a
+    # lost worker, or of one without answer after timeout seconds, are run again by an idle worker or by the coordinator
+    # itself and the evolution does not depend on where each membrane ran. Workers that missed the timeout get no new
+    # tasks until they answer the old ones. Every new connection is authenticated in its own thread and dropped if it
+    # does not answer in handshake_timeout seconds, so silent clients do not keep workers from joining
+    def __init__(self, address: Address, authkey: bytes, timeout: Optional[float] = None, handshake_timeout: Optional[float] = 10) -> None:
+        self.listener : Listener = Listener(address)
+        self.address : Address = self.listener.address
+        self.authkey : bytes = authkey
+        self.timeout : Optional[float] = timeout
+        self.handshake_timeout : float = handshake_timeout
+        self.workers : List[RemoteWorker] = []
+        self.joining : List[Connection] = []
+        self.lock : threading.Lock = threading.Lock()
+        self.closed : bool = False
+
+        self.membranes : List[Membrane] = []
+        self.owner : Dict[int, RemoteWorker] = {}
+        self.step : int = 0
+        self.results : List[Optional[Tuple[Genome, Dict[str, float]]]] = []
+        self.args : Optional[tuple] = None
+        # Workers lost, membrane tasks that missed the timeout and membranes run by the coordinator
+        self.stats : Dict[str, int] = {'lost_workers': 0, 'retried': 0, 'local': 0}
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self) -> None:
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except ConnectionError:
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self.handshake, args=(conn,), daemon=True).start()
+
+    def handshake(self, conn: Connection) -> None:
+        # The socket is shut down when the timeout expires, which ends a challenge waiting for an answer. Whichever
+        # takes finished first, the timer or the handshake, decides whether the connection is kept
+        sock = socket.socket(fileno=os.dup(conn.fileno()))
+        finished = threading.Lock()
+
+        def expire() -> None:
+            if finished.acquire(blocking=False):
+                sock.shutdown(socket.SHUT_RDWR)
+
+        timer = threading.Timer(self.handshake_timeout, expire)
+        timer.start()
+        try:
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            authenticated = finished.acquire(blocking=False)
+        except (AuthenticationError, EOFError, OSError):
+            authenticated = False
+        finally:
+            timer.cancel()
+            sock.close()
+        with self.lock:
+            if authenticated and not self.closed:
+                self.joining.append(conn)
+                return
+        conn.close()
+
+    def admit(self) -> None:
+        with self.lock:
+            self.workers += [RemoteWorker(conn) for conn in self.joining]
+            self.joining = []
+
+    def wait_workers(self, n: int, timeout: Optional[float] = None) -> int:
+        # Blocks until n workers are connected or timeout seconds pass, returns the number of connected workers
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.admit()
+            if len(self.workers) >= n or (deadline is not None and time.monotonic() > deadline):
+                return len(self.workers)
+            time.sleep(0.05)
+
+    def drop(self, worker: RemoteWorker) -> None:
+        if worker not in self.workers:
+            return
+        self.workers.remove(worker)
+        self.stats['lost_workers'] += 1
+        worker.conn.close()
+        self.assign([cell for step, cell in worker.pending if step == self.step and self.results[cell] is None])
+
+    def send(self, worker: RemoteWorker, cell: int) -> bool:
+        membrane = self.membranes[cell]
+        try:
+            if worker.step != self.step:
+                worker.conn.send(('cases', self.step, self.args))
+                worker.step = self.step
+            worker.conn.send(('train', self.step, cell, None if cell in worker.cells else membrane, membrane.population, membrane.random.bit_generator.state))
+        except (OSError, ValueError):
+            return False
+        worker.cells.add(cell)
+        worker.pending.add((self.step, cell))
+        self.owner[cell] = worker
+        return True
+
+    def run_local(self, cell: int) -> None:
+        membrane = self.membranes[cell]
+        self.results[cell] = (membrane.train_step(*self.args), membrane.stats)
+        self.stats['local'] += 1
+
+    def assign(self, cells: List[int]) -> None:
+        # Balanced among the idle workers, each membrane stays in its last worker when possible to reuse its caches.
+        # Without idle workers the coordinator runs the membranes
+        idle = [worker for worker in self.workers if not worker.pending]
+        if not idle:
+            for cell in cells:
+                self.run_local(cell)
+            return
+        target = ceil(len(cells) / len(idle))
+        load = {worker: 0 for worker in idle}
+        tasks = []
+        for cell in cells:
+            worker = self.owner.get(cell)
+            if worker not in load or load[worker] >= target:
+                worker = min(idle, key=load.__getitem__)
+            load[worker] += 1
+            tasks.append((worker, cell))
+        lost = set()
+        for worker, cell in tasks:
+            if worker in lost or not self.send(worker, cell):
+                lost.add(worker)
+                worker.pending.add((self.step, cell))
+        for worker in lost:
+            self.drop(worker)
+
+    def receive(self, worker: RemoteWorker) -> None:
+        try:
+            step, cell, best, stats, population, state = worker.conn.recv()
+        except (EOFError, OSError):
+            self.drop(worker)
+            return
+        worker.pending.discard((step, cell))
+        # Late answers of tasks already run somewhere else are dropped
+        if step == self.step and self.results[cell] is None:
+            membrane = self.membranes[cell]
+            membrane.population, membrane.stats = population, stats
+            membrane.random.bit_generator.state = state
+            self.results[cell] = (best, stats)
+
+    def poll(self) -> None:
+        # Reads the answers that already arrived, workers still running tasks of older steps are not idle
+        busy = {worker.conn: worker for worker in self.workers if worker.pending}
+        for conn in wait(list(busy), 0):
+            self.receive(busy[conn])
+
+    def train_step(self, membranes: List[Membrane], cases: List[Tuple[Word, bool]], n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int]) -> List[Tuple[Genome, Dict[str, float]]]:
+        # Best genome and stats of each membrane, the populations and rng states of membranes are updated in place
+        if membranes is not self.membranes:
+            # A new tissue, the membranes held by the workers are not valid anymore
+            self.membranes, self.owner = membranes, {}
+            for worker in self.workers:
+                worker.cells.clear()
+        self.admit()
+        self.poll()
+        self.step += 1
+        self.args = (cases if isinstance(cases, CaseBatch) else list(cases), n_crossovers, n_mutations, mutation_size_range)
+        self.results = [None] * len(membranes)
+        self.assign(list(range(len(membranes))))
+
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while (pending := [cell for cell, result in enumerate(self.results) if result is None]):
+            running = {cell for worker in self.workers for step, cell in worker.pending if step == self.step}
+            if not set(pending) <= running:
+                self.assign([cell for cell in pending if cell not in running])
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self.admit()
+                self.stats['retried'] += len(pending)
+                for cell in pending:
+                    self.owner.pop(cell, None)
+                self.assign(pending)
+                deadline = time.monotonic() + self.timeout
+                continue
+            busy = {worker.conn: worker for worker in self.workers if worker.pending}
+            for conn in wait(list(busy), remaining):
+                self.receive(busy[conn])
+        return self.results
+
+    def close(self) -> None:
+        self.closed = True
+        for worker in self.workers:
+            try:
+                worker.conn.send(('close',))
+            except (OSError, ValueError):
+                pass
+            worker.conn.close()
+        self.workers = []
+        try:
+            # Wakes up the accept thread
+            Client(self.address, authkey=self.authkey).close()
+        except (OSError, EOFError, AuthenticationError):
+            pass
+        self.listener.close()
+        with self.lock:
+            for conn in self.joining:
+                conn.close()
+            self.joining = []
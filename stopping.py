@@ -0,0 +1,63 @@
+from time import perf_counter
+from typing import List, Tuple, Optional, Sequence
+
+from tissue import Tissue
+from fitness import CaseChunks
+
+
+Symbol = str
+Word = List[Symbol]
+
+
+class EarlyStopping:
+    # Stopping policies of a training run, update is called after every train step and returns the reason to stop:
+    #   'perfect'     the best genome of some membrane classifies every training case right
+    #   'patience'    the best fitness on the reference training cases (see tissue.Archive) did not improve in patience steps
+    #   'time'        max_seconds of training
+    #   'evaluations' max_evaluations (genome, case) fitness evaluations requested by the membranes
+    def __init__(self, stop_on_perfect: Optional[bool] = False, patience: Optional[int] = None, max_seconds: Optional[float] = None,
+                 max_evaluations: Optional[int] = None) -> None:
+        self.stop_on_perfect : bool = stop_on_perfect
+        self.patience : Optional[int] = patience
+        self.max_seconds : Optional[float] = max_seconds
+        self.max_evaluations : Optional[int] = max_evaluations
+
+        self.steps : int = 0
+        self.evaluations : int = 0
+        self.best : float = 0
+        self.stall : int = 0
+        self.elapsed : float = 0
+        self.started : float = perf_counter()
+        self.cases : Optional[CaseChunks] = None
+
+    def seconds(self) -> float:
+        return self.elapsed + perf_counter() - self.started
+
+    def update(self, tissue: Tissue, train_cases: Sequence[Tuple[Word, bool]]) -> Optional[str]:
+        self.steps += 1
+        self.evaluations += sum(stats['evaluations'] for stats in tissue.stats)
+        fitness = tissue.reference_fitness()
+        if fitness > self.best:
+            self.best, self.stall = fitness, 0
+        else:
+            self.stall += 1
+
+        if self.stop_on_perfect:
+            if self.cases is None:
+                self.cases = CaseChunks(train_cases, sorted(tissue.terminal))
+            if tissue.perfect(self.cases):
+                return 'perfect'
+        if self.patience is not None and self.stall >= self.patience:
+            return 'patience'
+        if self.max_seconds is not None and self.seconds() >= self.max_seconds:
+            return 'time'
+        if self.max_evaluations is not None and self.evaluations >= self.max_evaluations:
+            return 'evaluations'
+        return None
+
+    def state(self) -> dict:
+        return {'steps': self.steps, 'evaluations': self.evaluations, 'best': self.best, 'stall': self.stall, 'elapsed': self.seconds()}
+
+    def restore(self, state: dict) -> None:
+        self.steps, self.evaluations, self.best, self.stall = state['steps'], state['evaluations'], state['best'], state['stall']
+        self.elapsed, self.started = state['elapsed'], perf_counter()
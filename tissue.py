@@ -1,16 +1,26 @@
 from __future__ import annotations
 
+import os
+import json
 import random
 from itertools import repeat
 
-from grammar import Grammar
-from fitness import fitness, multiple_fitness
-from genome import random_combination, random_simple_mutations
+from cache import LRUCache
+from grammar import Grammar, CompiledGrammar
+from fitness import CaseBatch, CaseChunks, cached_cyk_fitness, cached_multiple_fitness, population_fitness
+from genome import Genome, GenomeCodec, Population, genome_key, canonical_codes, derives_words, offspring
+from instrumentation import Stopwatch, counters
 
 import multiprocessing
+import numpy as np
+from collections import defaultdict
 from functools import partialmethod
-from random import choices, randint
-from typing import Set, Dict, Union, Tuple, List, Optional, Callable
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Set, Dict, Union, Tuple, List, Optional, Callable, Hashable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from remote import Coordinator
 
 
 Symbol = str
@@ -19,58 +29,455 @@ Productions = Dict[Symbol, Set[Union[Tuple[Symbol], Tuple[Symbol, Symbol]]]]
 
 
 class Membrane:
-    def __init__(self, non_terminal: Set[Symbol], terminal: Set[Symbol], s: Symbol, n_non_term_prod: int, n_terminal_prod: int, n_grammars: int, empty: Optional[bool] = False) -> None:
+    def __init__(self, non_terminal: Set[Symbol], terminal: Set[Symbol], s: Symbol, n_non_term_prod: int, n_terminal_prod: int, n_grammars: int, empty: Optional[bool] = False, cache_size: Optional[int] = 2**16, memo_size: Optional[int] = 1024, seed: Optional[int] = None, evaluator: Optional[str] = 'genome', instrument: Optional[bool] = False,
+                 tournament_size: Optional[int] = None) -> None:
         self.s : Symbol = s
         self.terminal : Set[Symbol] = terminal
         self.non_terminal : Set[Symbol] = non_terminal
+        self.codec : GenomeCodec = GenomeCodec(non_terminal, terminal)
 
         self.n_grammars : int = n_grammars
+        self.n_productions : int = n_non_term_prod + n_terminal_prod
+        self.cache : LRUCache[float] = LRUCache(cache_size)
+        self.memo : LRUCache[CompiledGrammar] = LRUCache(memo_size)
+        seed = random.getrandbits(64) if seed is None else seed
+        self.random : np.random.Generator = np.random.default_rng(seed)
+        # 'genome' scores each genome with the cached bitset CYK, 'population' scores the whole population at once
+        self.evaluator : str = evaluator
+        # Parents are drawn uniformly from the population, or as the best of tournament_size random genomes if given
+        self.tournament_size : Optional[int] = tournament_size
+        # Last train_step: fitness of the best genome over 1 and its age, ratio of genomes repeating the grammar of another
+        # one, (genome, case) evaluations skipped because S derives no word and (genome, case) evaluations requested
+        self.stats : Dict[str, float] = {'best_fitness': 0, 'best_age': 0, 'duplicate_ratio': 0, 'saved_evaluations': 0, 'evaluations': 0}
+        # With instrument the stats also get the time of each phase (time_*), the CYK work (cyk_*) and the hits and
+        # misses of the fitness cache and the compiled grammars memo (cache_*, memo_*)
+        self.watch : Stopwatch = Stopwatch(instrument)
 
-        self.grammars : List[List[Symbol]] = []
+        # Array genomes, see GenomeCodec
+        self.population : Population = Population(np.zeros((0, self.n_productions, 3), dtype=np.int8))
         if not empty:
-            self.grammars = [Grammar.random(non_terminal, terminal, s, n_non_term_prod, n_terminal_prod).encoded() for _ in range(n_grammars)]
+            rng = random.Random(seed)
+            self.grammars = np.stack([self.codec.encode(Grammar.random(non_terminal, terminal, s, n_non_term_prod, n_terminal_prod, rng).encoded())
+                                      for _ in range(n_grammars)])
+
+    @property
+    def grammars(self) -> np.ndarray:
+        return self.population.genomes
+
+    @grammars.setter
+    def grammars(self, genomes: np.ndarray) -> None:
+        # New genomes start a new population, without fitness or age
+        self.population = Population(genomes)
+
+    def __getstate__(self) -> dict:
+        # Compiled grammars are not picklable, the memo is rebuilt on demand
+        state = self.__dict__.copy()
+        state['memo'] = LRUCache(self.memo.capacity)
+        return state
+
+    def decode(self, gen: Genome) -> Grammar:
+        return Grammar.decode(self.non_terminal, self.terminal, self.s, self.codec.decode(gen))
+
+    def compile(self, gen: Genome) -> CompiledGrammar:
+        key = genome_key(gen)
+        compiled = self.memo.get(key)
+        if compiled is None:
+            with self.watch('decode'):
+                compiled = CompiledGrammar(self.s, self.codec.productions(gen))
+            self.memo.put(key, compiled)
+        return compiled
 
-    def decode(self, gen: List[Symbol]) -> Grammar:
-        return Grammar.decode(self.non_terminal, self.terminal, self.s, gen)
+    def fitness(self, gen: Genome, cases: List[Tuple[Word, bool]]) -> float:
+        return cached_multiple_fitness(self.cache, genome_key(gen), lambda: self.compile(gen), cases)
 
+    def scores(self, cases: List[Tuple[Word, bool]]) -> np.ndarray:
+        # Each distinct grammar is evaluated once and its score is shared by its duplicates
+        if not len(self.grammars):
+            return np.zeros(0)
+        codes = canonical_codes(self.grammars)
+        _, unique, inverse = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+        self.stats['duplicate_ratio'] = 1 - len(unique) / len(codes)
 
-    def train_step(self, cases: List[Tuple[Word, bool]], n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int]) -> List[Symbol]:
-        self.grammars.sort(key=lambda g: multiple_fitness(self.decode(g), cases), reverse=True)
-        best = self.grammars[0]
-        crossed = [random_combination(self.terminal, a, b)
-                   for a, b in [choices(self.grammars, k=2) for _ in range(n_crossovers)]]
-        mutated = [random_simple_mutations(self.non_terminal, self.terminal, gen, randint(mutation_size_range[0], mutation_size_range[1]))
-                   for gen in choices(self.grammars, k=n_mutations)]
-        self.grammars = mutated + crossed + self.grammars[:self.n_grammars - n_mutations - n_crossovers]
+        # S derives no substring of any word when it derives no word at all, so those grammars score 0 on every
+        # positive case and 1 on every negative one
+        live = derives_words(self.grammars[unique], self.codec.index[self.s], len(self.codec.symbols))
+        self.stats['saved_evaluations'] = (len(unique) - int(live.sum())) * len(cases)
+        self.stats['evaluations'] = int(live.sum()) * len(cases)
+        fits = np.full(len(unique), float(sum(not p for _, p in cases)))
+        if self.evaluator == 'population':
+            fits[live] = population_fitness(self.non_terminal, self.terminal, self.s, self.grammars[unique[live]], cases)
+        else:
+            # The canonical codes are the cache keys, see genome_key
+            fits[live] = [cached_multiple_fitness(self.cache, codes[i].tobytes(), lambda i=i: self.compile(self.grammars[i]), cases) for i in unique[live]]
+        return fits[inverse.reshape(-1)]
+
+    def train_step(self, cases: List[Tuple[Word, bool]], n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int]) -> Genome:
+        # The counters are only enabled during the steps of instrumented membranes
+        with counters.enable(self.watch.enabled):
+            if self.watch.enabled:
+                self.watch.reset()
+                before = counters.snapshot()
+                hits = (self.cache.hits, self.cache.misses, self.memo.hits, self.memo.misses)
+
+            population = self.population
+            with self.watch('fitness'):
+                population.evaluated(self.scores(cases))
+            with self.watch('selection'):
+                i = population.best()
+                best = population.genomes[i].copy()
+                self.stats['best_fitness'] = population.fitness[i] / len(cases)
+                self.stats['best_age'] = int(population.age[i])
+                parents = None if self.tournament_size is None else population.tournament(n_mutations + 2 * n_crossovers, self.tournament_size, self.random)
+            with self.watch('offspring'):
+                children = offspring(population.genomes, n_crossovers, n_mutations, mutation_size_range, len(self.codec.symbols), len(self.codec.alphabet), self.random, parents)
+            with self.watch('replacement'):
+                keep = max(self.n_grammars - len(children), 0)
+                if len(population) == keep + len(children):
+                    population.replace(population.worst(len(children)), children)
+                else:
+                    # Populations of other sizes, as the out membrane, end up with the children and the keep best genomes
+                    self.grammars = np.concatenate([children, population.genomes[population.top(keep)]])
+
+            if self.watch.enabled:
+                self.stats.update({f'time_{phase}': t for phase, t in self.watch.times.items()})
+                self.stats.update(counters.since(before))
+                now = (self.cache.hits, self.cache.misses, self.memo.hits, self.memo.misses)
+                self.stats.update(zip(('cache_hits', 'cache_misses', 'memo_hits', 'memo_misses'), (b - a for a, b in zip(hits, now))))
         return best
 
     def best(self, test_cases: List[Tuple[Word, bool]]) -> Tuple[Grammar, float]:
-        scored = sorted(self.grammars, key=lambda g: multiple_fitness(self.decode(g), test_cases), reverse=True)
-        decoded = self.decode(scored[0])
-        fit = sum(fitness(decoded, word, positive) for word, positive in test_cases) / len(test_cases)
-        return decoded, fit
+        with self.watch('fitness'):
+            scores = self.scores(test_cases)
+        i = int(np.argmax(scores))
+        return self.decode(self.grammars[i]), scores[i] / len(test_cases)
+
+
+class Archive(Membrane):
+    # Out membrane: the genomes sent by the membranes without duplicates, ranked by their fitness on the reference cases,
+    # a fixed sample of the training cases scored once when a genome is archived. Only the capacity ones with the best
+    # reference fitness are kept, without reference cases nothing is evicted since the batch fitness of different steps
+    # can not be compared. The test fitness is cached between calls to best
+    def __init__(self, non_terminal: Set[Symbol], terminal: Set[Symbol], s: Symbol, n_non_term_prod: int, n_terminal_prod: int, n_grammars: int, capacity: Optional[int] = 256, **kwargs) -> None:
+        super().__init__(non_terminal, terminal, s, n_non_term_prod, n_terminal_prod, n_grammars, empty=True, **kwargs)
+        self.capacity : Optional[int] = capacity
+        self.keys : List[Hashable] = []
+        self.train_scores : List[float] = []
+        self.test_scores : Dict[Hashable, float] = {}
+        self.test_cases : Optional[Union[List[Tuple[Word, bool]], CaseChunks]] = None
+        self.reference : Optional[CaseBatch] = None
+
+    def clear(self) -> None:
+        self.grammars = self.grammars[:0]
+        self.keys, self.train_scores = [], []
+
+    def set_reference(self, cases: CaseBatch) -> None:
+        self.reference = cases
+        self.train_scores = [self.rank(gen) for gen in self.grammars]
+        self.extend([])
+
+    def rank(self, gen: Genome) -> float:
+        # Fitness over 1 on the reference cases, cached as any other fitness
+        if self.reference is None or not len(self.reference):
+            return 0
+        return self.fitness(gen, self.reference) / len(self.reference)
+
+    def extend(self, genomes: List[Genome], scores: Optional[List[float]] = None) -> None:
+        # scores are the reference fitness of the genomes when already known, as in a snapshot
+        rows = list(self.grammars)
+        keys = set(self.keys)
+        for i, gen in enumerate(genomes):
+            key = genome_key(gen)
+            if key not in keys:
+                keys.add(key)
+                rows.append(gen)
+                self.keys.append(key)
+                self.train_scores.append(self.rank(gen) if scores is None else scores[i])
+
+        if self.capacity is not None and self.reference is not None and len(rows) > self.capacity:
+            # Evicts the worst reference scores, the oldest first on ties
+            keep = sorted(sorted(range(len(rows)), key=lambda i: (self.train_scores[i], i), reverse=True)[:self.capacity])
+            rows = [rows[i] for i in keep]
+            self.keys = [self.keys[i] for i in keep]
+            self.train_scores = [self.train_scores[i] for i in keep]
+            kept = set(self.keys)
+            self.test_scores = {k: v for k, v in self.test_scores.items() if k in kept}
+        if rows:
+            self.grammars = np.stack(rows)
+
+    def train_step(self, cases: List[Tuple[Word, bool]], n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int]) -> Genome:
+        best = super().train_step(cases, n_crossovers, n_mutations, mutation_size_range)
+        genomes = self.grammars
+        self.clear()
+        self.extend(genomes)
+        return best
+
+    def best(self, test_cases: Union[List[Tuple[Word, bool]], CaseChunks]) -> Tuple[Grammar, float]:
+        # Only the genomes archived since the last call are scored, chunk by chunk with CaseChunks
+        if test_cases is not self.test_cases:
+            self.test_cases = test_cases
+            self.test_scores = {}
+        new = [(gen, key) for gen, key in zip(self.grammars, self.keys) if key not in self.test_scores]
+        if new:
+            scores = dict.fromkeys([key for _, key in new], 0.0)
+            for chunk in test_cases if isinstance(test_cases, CaseChunks) else [test_cases]:
+                for gen, key in new:
+                    scores[key] += self.fitness(gen, chunk)
+            self.test_scores.update(scores)
+        scores = [self.test_scores[key] for key in self.keys]
+        best = max(range(len(scores)), key=scores.__getitem__)
+        return self.decode(self.grammars[best]), scores[best] / len(test_cases)
+
+
+class SharedPopulations:
+    # Array populations of several membranes in one shared memory block, preceded by the population size of each one
+    def __init__(self, shape: Tuple[int, int, int, int], name: Optional[str] = None) -> None:
+        self.owner : bool = name is None
+        header = 8 * shape[0]
+        self.shm : SharedMemory = SharedMemory(name=name, create=self.owner, size=header + int(np.prod(shape)))
+        self.sizes : np.ndarray = np.ndarray(shape[0], dtype=np.int64, buffer=self.shm.buf)
+        self.array : np.ndarray = np.ndarray(shape, dtype=np.int8, buffer=self.shm.buf, offset=header)
+
+    def read(self, cell: int) -> np.ndarray:
+        return self.array[cell, :self.sizes[cell]].copy()
+
+    def write(self, cell: int, grammars: np.ndarray) -> None:
+        if len(grammars) > self.array.shape[1]:
+            raise ValueError(f'Population of {len(grammars)} genomes does not fit in {self.array.shape[1]} slots')
+        self.array[cell, :len(grammars)] = grammars
+        self.sizes[cell] = len(grammars)
+
+    def close(self) -> None:
+        del self.array, self.sizes
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def membrane_worker(conn: Connection, shm_name: str, shape: Tuple[int, int, int, int], cells: List[int], membranes: List[Membrane]) -> None:
+    populations = SharedPopulations(shape, shm_name)
+    try:
+        while (message := conn.recv())[0] != 'close':
+            if message[0] == 'state':
+                conn.send([membrane.random.bit_generator.state for membrane in membranes])
+                continue
+            best = []
+            # The populations are only written here while the pool lives, so the membranes already hold them
+            for cell, membrane in zip(cells, membranes):
+                best.append((membrane.train_step(*message[1]), membrane.stats))
+                populations.write(cell, membrane.grammars)
+            conn.send(best)
+    finally:
+        populations.close()
+
+
+class MembranePool:
+    # Long-lived workers, each one owns a group of membranes, only the cases and the best genomes are sent every step
+    def __init__(self, membranes: List[Membrane], n_workers: int) -> None:
+        self.n_cells : int = len(membranes)
+        shape = (len(membranes), max(len(m.grammars) for m in membranes), membranes[0].n_productions, 3)
+        self.populations : SharedPopulations = SharedPopulations(shape)
+        for cell, membrane in enumerate(membranes):
+            self.populations.write(cell, membrane.grammars)
+
+        self.groups : List[List[int]] = [list(range(i, len(membranes), n_workers)) for i in range(min(n_workers, len(membranes)))]
+        self.connections : List[Connection] = []
+        self.workers : List[multiprocessing.Process] = []
+        for cells in self.groups:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=membrane_worker, daemon=True,
+                                             args=(child_conn, self.populations.shm.name, shape, cells, [membranes[c] for c in cells]))
+            worker.start()
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.workers.append(worker)
+
+    def train_step(self, cases: List[Tuple[Word, bool]], n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int]) -> List[Tuple[Genome, Dict[str, float]]]:
+        # Best genome and stats of each membrane
+        for conn in self.connections:
+            conn.send(('step', (cases, n_crossovers, n_mutations, mutation_size_range)))
+        best = [None] * self.n_cells
+        for cells, conn in zip(self.groups, self.connections):
+            for cell, gen in zip(cells, conn.recv()):
+                best[cell] = gen
+        return best
+
+    def read(self, cell: int) -> np.ndarray:
+        return self.populations.read(cell)
+
+    def states(self) -> List[dict]:
+        # Rng states of the membranes owned by the workers
+        for conn in self.connections:
+            conn.send(('state',))
+        states = [None] * self.n_cells
+        for cells, conn in zip(self.groups, self.connections):
+            for cell, state in zip(cells, conn.recv()):
+                states[cell] = state
+        return states
+
+    def close(self) -> None:
+        for conn, worker in zip(self.connections, self.workers):
+            conn.send(('close',))
+            worker.join()
+            conn.close()
+        self.populations.close()
 
 
 class Tissue:
-    def __init__(self, non_terminal: Set[Symbol], terminal: Set[Symbol], s: Symbol, n_non_term_prod: int, n_terminal_prod: int, n_cells: int, n_grammars: int) -> None:
+    def __init__(self, non_terminal: Set[Symbol], terminal: Set[Symbol], s: Symbol, n_non_term_prod: int, n_terminal_prod: int, n_cells: int, n_grammars: int,
+                 cache_size: Optional[int] = 2**16, memo_size: Optional[int] = 1024, seed: Optional[int] = None, n_workers: Optional[int] = 0,
+                 evaluator: Optional[str] = 'genome', archive_size: Optional[int] = 256, instrument: Optional[bool] = False,
+                 coordinator: Optional[Coordinator] = None, tournament_size: Optional[int] = None) -> None:
         self.s : Symbol = s
         self.terminal : Set[Symbol] = terminal
         self.non_terminal : Set[Symbol] = non_terminal
 
         self.n_grammars : int = n_grammars
+        self.n_workers : int = n_workers
+        self.pool : Optional[MembranePool] = None
+        # With a coordinator the membranes run on its remote workers instead, it is owned by the caller and can be shared
+        # by successive tissues
+        self.coordinator : Optional[Coordinator] = coordinator
+        # Best genome and stats of every membrane in the last train_step
+        self.best_genomes : List[Genome] = []
+        self.stats : List[Dict[str, float]] = []
+        # Instrumentation totals of the whole run, see instrumentation()
+        self.watch : Stopwatch = Stopwatch(instrument)
+        self.totals : Dict[str, float] = defaultdict(float)
 
-        self.membranes : List[Membrane] = [Membrane(non_terminal, terminal, s, n_non_term_prod, n_terminal_prod, n_grammars) for _ in range(n_cells)]
-        self.out : Membrane = Membrane(non_terminal, terminal, s, n_non_term_prod, n_terminal_prod, n_grammars, empty=True)
+        # Every membrane owns its rng, so the evolution does not depend on where or in which order membranes run
+        rng = random.Random(random.getrandbits(64) if seed is None else seed)
+        self.membranes : List[Membrane] = [Membrane(non_terminal, terminal, s, n_non_term_prod, n_terminal_prod, n_grammars, cache_size=cache_size, memo_size=memo_size, seed=rng.getrandbits(64), evaluator=evaluator, instrument=instrument, tournament_size=tournament_size) for _ in range(n_cells)]
+        self.out : Archive = Archive(non_terminal, terminal, s, n_non_term_prod, n_terminal_prod, n_grammars, archive_size, cache_size=cache_size, memo_size=memo_size, seed=rng.getrandbits(64), evaluator=evaluator, tournament_size=tournament_size)
 
     def aux(self, membrane: Membrane, cases: List[Tuple[Word, bool]], n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int]) -> List[str]:
         return membrane.train_step(cases, n_crossovers, n_mutations, mutation_size_range)
 
     def train_step(self, cases: List[Tuple[Word, bool]], n_crossovers: int, n_mutations: int, mutation_size_range: Tuple[int, int], mutate_out: Optional[bool] = False) -> None:
-        for membrane in self.membranes:
-            self.out.grammars.append(membrane.train_step(cases, n_crossovers, n_mutations, mutation_size_range))
-        if mutate_out:
-            self.out.train_step(cases, n_crossovers, n_mutations, mutation_size_range)
+        with self.watch('membranes'):
+            if self.coordinator is not None:
+                best = self.coordinator.train_step(self.membranes, cases, n_crossovers, n_mutations, mutation_size_range)
+            elif self.n_workers:
+                if self.pool is None:
+                    self.pool = MembranePool(self.membranes, self.n_workers)
+                best = self.pool.train_step(cases, n_crossovers, n_mutations, mutation_size_range)
+            else:
+                best = [(membrane.train_step(cases, n_crossovers, n_mutations, mutation_size_range), membrane.stats) for membrane in self.membranes]
+        self.best_genomes = [gen for gen, _ in best]
+        self.stats = [stats for _, stats in best]
 
+        # The membranes measure their own work, the tissue measures the out membrane
+        with counters.enable(self.watch.enabled):
+            before = counters.snapshot() if self.watch.enabled else None
+            with self.watch('archive'):
+                self.out.extend([gen for gen, _ in best])
+            if mutate_out:
+                with self.watch('mutate_out'):
+                    self.out.train_step(cases, n_crossovers, n_mutations, mutation_size_range)
+            if self.watch.enabled:
+                self.add_totals(counters.since(before))
+                for stats in self.stats:
+                    self.add_totals({k: v for k, v in stats.items() if k.startswith(('time_', 'cyk_', 'substring_', 'cache_', 'memo_')) or k == 'saved_evaluations'})
 
-    def best(self, test_cases: List[Tuple[Word, bool]]) -> Tuple[Grammar, float]:
-        return self.out.best(test_cases)
+    def set_reference(self, cases: CaseBatch) -> None:
+        # Training cases the out membrane ranks its genomes with, see Archive
+        self.out.set_reference(cases)
+
+    def add_totals(self, values: Dict[str, float], prefix: Optional[str] = '') -> None:
+        for k, v in values.items():
+            self.totals[prefix + k] += v
+
+    def instrumentation(self) -> dict:
+        # Totals since the tissue was created: wall time of the tissue phases and of the membrane phases (summed over the
+        # membranes), CYK work in training and test and hit rates of the fitness cache, of the compiled grammars memo and of
+        # the substring memo of the CYK
+        totals = self.totals
+        lookups = totals['cache_hits'] + totals['cache_misses']
+        memo_lookups = totals['memo_hits'] + totals['memo_misses']
+        substring_lookups = totals['substring_hits'] + totals['substring_misses']
+        return {
+            'tissue_times': dict(self.watch.times),
+            'membrane_times': {k[len('time_'):]: v for k, v in totals.items() if k.startswith('time_')},
+            'cyk_words': totals['cyk_words'],
+            'cyk_cells': totals['cyk_cells'],
+            'test_cyk_words': totals['test_cyk_words'],
+            'test_cyk_cells': totals['test_cyk_cells'],
+            'saved_evaluations': totals['saved_evaluations'],
+            'cache_hit_rate': totals['cache_hits'] / lookups if lookups else 0,
+            'compiled_memo_hit_rate': totals['memo_hits'] / memo_lookups if memo_lookups else 0,
+            'substring_hit_rate': totals['substring_hits'] / substring_lookups if substring_lookups else 0,
+        }
+
+    def reference_fitness(self) -> float:
+        # Best fitness over 1 of the archived genomes on the reference cases, comparable between steps unlike the batch
+        # fitness of the membranes
+        return max(self.out.train_scores, default=0)
+
+    def duplicate_ratio(self) -> float:
+        return sum(stats['duplicate_ratio'] for stats in self.stats) / len(self.stats) if self.stats else 0
+
+    def perfect(self, cases: Union[List[Tuple[Word, bool]], CaseChunks]) -> bool:
+        # Whether the best genome of some membrane in the last train_step accepts exactly the positive cases, the fitness
+        # itself rarely reaches 1 since negative words with derivable substrings get partial scores
+        candidates = {genome_key(gen): gen for gen in self.best_genomes}
+        for batch in cases if isinstance(cases, CaseChunks) else [cases]:
+            words = batch if isinstance(batch, CaseBatch) else [w for w, _ in batch]
+            for key, gen in list(candidates.items()):
+                scores = cached_cyk_fitness(self.out.cache, key, lambda: self.out.compile(gen), words)
+                if not all((fit == 1) == p for fit, (_, p) in zip(scores, batch)):
+                    del candidates[key]
+            if not candidates:
+                return False
+        return bool(candidates)
+
+    def saved_evaluations(self) -> int:
+        return sum(stats['saved_evaluations'] for stats in self.stats)
+
+    def sync(self) -> None:
+        # Copies the populations and rng states held by the workers back into self.membranes
+        if self.pool is not None:
+            for cell, (membrane, state) in enumerate(zip(self.membranes, self.pool.states())):
+                membrane.grammars = self.pool.read(cell)
+                membrane.random.bit_generator.state = state
+
+    def save(self, path: str, cursor: Optional[dict] = None) -> None:
+        # Binary snapshot (npz) of every population and rng state, cursor is any json serializable training state
+        self.sync()
+        state = {'random': [m.random.bit_generator.state for m in self.membranes + [self.out]], 'cursor': cursor}
+        arrays = {f'membrane_{i}': m.grammars for i, m in enumerate(self.membranes)}
+        arrays['out'] = self.out.grammars
+        arrays['out_scores'] = np.array(self.out.train_scores)
+        arrays['state'] = np.frombuffer(json.dumps(state).encode(), dtype=np.uint8)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> Optional[dict]:
+        # Restores a snapshot written by save and returns its cursor, the workers are restarted on the next step
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        with np.load(path, allow_pickle=False) as data:
+            state = json.loads(data['state'].tobytes().decode())
+            for i, membrane in enumerate(self.membranes):
+                membrane.grammars = data[f'membrane_{i}']
+            self.out.clear()
+            self.out.extend(list(data['out']), data['out_scores'].tolist())
+        for membrane, random_state in zip(self.membranes + [self.out], state['random']):
+            membrane.random.bit_generator.state = random_state
+        return state['cursor']
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.sync()
+            self.pool.close()
+            self.pool = None
+
+    def best(self, test_cases: Union[List[Tuple[Word, bool]], CaseChunks]) -> Tuple[Grammar, float]:
+        with counters.enable(self.watch.enabled):
+            before = counters.snapshot() if self.watch.enabled else None
+            with self.watch('test'):
+                best = self.out.best(test_cases)
+            if self.watch.enabled:
+                self.add_totals(counters.since(before), 'test_')
+        return best
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import random
+import platform
+import statistics
+import numpy as np
+from glob import glob
+from typing import Callable, Dict, List, Optional, Tuple, Any
+
+from grammar import Grammar, WordEnumerator
+from fitness import cyk_table, cyk_fitness, multiple_fitness, balanced_cases
+from oracles import get_oracle
+from tissue import Membrane, Tissue
+
+
+Symbol = str
+Word = List[Symbol]
+
+GRAMMARS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'grammars')
+WORD_LENGTHS = [8, 16, 32]
+POPULATION_SIZES = [20, 100]
+N_CELLS = [1, 4]
+# Training cases of the fitness and train_step benchmarks, used in batches of 10
+N_CASES = 40
+SEED = 0
+
+
+def measure(setup: Callable[[], Any], run: Callable[[Any], Any], repeat: int) -> Dict[str, float]:
+    # Seconds per run of run(setup()), setup is not timed and runs again before every repetition so all of them start
+    # from the same state, the first run only warms up
+    times = []
+    for i in range(repeat + 1):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        if i:
+            times.append(time.perf_counter() - start)
+    return {'median': statistics.median(times), 'min': min(times), 'repeat': repeat}
+
+
+def load_grammars(path: Optional[str] = GRAMMARS_DIR) -> Dict[str, Tuple[Grammar, Optional[str]]]:
+    grammars = {}
+    for file in sorted(glob(os.path.join(path, '*.json'))):
+        with open(file, 'r') as f:
+            oracle = json.load(f).get('oracle')
+        grammars[os.path.splitext(os.path.basename(file))[0]] = (Grammar.load(file), oracle)
+    return grammars
+
+
+def sample_words(g: Grammar, length: int, n: int, rng: random.Random) -> List[Word]:
+    # Half words of the language when there are any of that length and half random words. The words of the language
+    # come from uniform derivation trees, uniform words can not be sampled from the ambiguous grammars at these lengths
+    enumerator = WordEnumerator(g)
+    positives = [enumerator.sample(length, rng, by_tree=True) for _ in range(n // 2)] if enumerator.count(length) else []
+    alphabet = sorted(g.terminal)
+    return positives + [[rng.choice(alphabet) for _ in range(length)] for _ in range(n - len(positives))]
+
+
+def random_population(g: Grammar, n: int, rng: random.Random) -> List[Grammar]:
+    return [Grammar.random(g.non_terminal, g.terminal, g.s, 2 * len(g.non_terminal), len(g.terminal), rng) for _ in range(n)]
+
+
+def seeded(build: Callable[[], Any]) -> Callable[[], Any]:
+    def setup():
+        random.seed(SEED)
+        np.random.seed(SEED)
+        return build()
+    return setup
+
+
+def benchmarks(grammars: Dict[str, Tuple[Grammar, Optional[str]]]) -> Dict[str, Tuple[Callable[[], Any], Callable[[Any], Any]]]:
+    # name -> (setup, run), the inputs only depend on SEED
+    out = {}
+    for name, (g, oracle) in grammars.items():
+        params = dict(non_terminal=g.non_terminal, terminal=g.terminal, s=g.s, n_non_term_prod=2 * len(g.non_terminal), n_terminal_prod=len(g.terminal))
+        random.seed(SEED)
+        positives, negatives = balanced_cases(g, N_CASES, 0.5, get_oracle(g, oracle))
+        cases = positives + negatives
+        random.Random(SEED).shuffle(cases)
+
+        for length in WORD_LENGTHS:
+            words = sample_words(g, length, 10, random.Random(SEED))
+            out[f'cyk_table/{name}/n={length}'] = (lambda: None, lambda _, g=g, words=words: [cyk_table(g, w) for w in words])
+            out[f'cyk_fitness/{name}/n={length}'] = (lambda: None, lambda _, g=g, words=words: [cyk_fitness(g, w) for w in words])
+
+        population = random_population(g, 20, random.Random(SEED)) + [g]
+        out[f'multiple_fitness/{name}'] = (lambda population=population: [Grammar(p.non_terminal, p.terminal, p.productions, p.s) for p in population],
+                                           lambda population, cases=cases: [multiple_fitness(p, cases) for p in population])
+
+        for size in POPULATION_SIZES:
+            out[f'membrane_train_step/{name}/grammars={size}'] = (
+                seeded(lambda params=params, size=size: Membrane(n_grammars=size, seed=SEED, **params)),
+                lambda membrane, size=size, cases=cases: [membrane.train_step(cases[i:i+10], size // 5, size // 5, (1, 3)) for i in range(0, N_CASES, 10)])
+
+        for n_cells in N_CELLS:
+            out[f'tissue_train_step/{name}/cells={n_cells}'] = (
+                seeded(lambda params=params, n_cells=n_cells: Tissue(n_cells=n_cells, n_grammars=50, seed=SEED, **params)),
+                lambda tissue, cases=cases: [tissue.train_step(cases[i:i+10], 10, 10, (1, 3)) for i in range(0, N_CASES, 10)])
+
+        out[f'words_iterator/{name}/words=20'] = (lambda: None, lambda _, g=g: [w for w, _ in zip(g.words_iterator(), range(20))])
+        out[f'word_enumerator/{name}/words=1000'] = (lambda g=g: WordEnumerator(g), lambda enumerator: [w for w, _ in zip(enumerator.words_by_length(), range(1000))])
+        out[f'balanced_cases/{name}/cases=1000'] = (seeded(lambda g=g, oracle=oracle: get_oracle(g, oracle)), lambda oracle, g=g: balanced_cases(g, 1000, 0.5, oracle))
+    return out
+
+
+def run_benchmarks(out_path: str, repeat: Optional[int] = 5, pattern: Optional[str] = None, verb: Optional[bool] = True) -> dict:
+    results = {}
+    for name, (setup, run) in benchmarks(load_grammars()).items():
+        if pattern is not None and pattern not in name:
+            continue
+        results[name] = measure(setup, run, repeat)
+        if verb: print(f'{name:50} {results[name]["median"] * 1000:10.3f} ms')
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'seed': SEED,
+        },
+        'results': results
+    }
+    with open(out_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+def compare(report: dict, previous_path: str, threshold: Optional[float] = 0.1) -> List[str]:
+    # Names of the benchmarks more than threshold (relative) slower than in the previous report, the fastest run of each
+    # one is compared since the slower ones mostly measure the noise of the machine
+    with open(previous_path, 'r') as f:
+        previous = json.load(f)['results']
+    regressions = []
+    for name, result in report['results'].items():
+        if name not in previous:
+            continue
+        ratio = result['min'] / previous[name]['min']
+        flag = 'REGRESSION' if ratio > 1 + threshold else 'improved' if ratio < 1 / (1 + threshold) else ''
+        print(f'{name:50} {previous[name]["min"] * 1000:10.3f} -> {result["min"] * 1000:10.3f} ms  x{ratio:6.2f}  {flag}')
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
@@ -1,13 +1,23 @@
 import json
 import os
+from typing import Optional
 
+from corpus import write_corpus
 from fitness import balanced_cases
 from grammar import Grammar
+from oracles import get_oracle
 
 
-def build_cases(n_positives: int, n_negatives: int, grammar_path: str, out_path: str) -> None:
+def build_cases(n_positives: int, n_negatives: int, grammar_path: str, out_path: str, binary: Optional[bool] = False) -> None:
     n = n_positives + n_negatives
-    pos, neg = balanced_cases(Grammar.load(grammar_path), n, n_positives / n)
+    grammar = Grammar.load(grammar_path)
+    with open(grammar_path, 'r') as f:
+        oracle = get_oracle(grammar, json.load(f).get('oracle'))
+    pos, neg = balanced_cases(grammar, n, n_positives / n, oracle)
+    if binary:
+        write_corpus(out_path, pos + neg, grammar.terminal, os.path.realpath(grammar_path))
+        return
+
     out = {'positive': [case[0] for case in pos],
            'negative': [case[0] for case in neg],
            'grammar_path': os.path.realpath(grammar_path)}
@@ -8,6 +8,9 @@ from typing import Callable, List, Dict, Tuple
 import statistics
 from collections import defaultdict
 
+from corpus import cases_metadata
+from tools.results import load_results
+
 
 def get_raw_params(exp_path: str) -> List[str]:
     with open(exp_path, 'r') as f:
@@ -16,14 +19,13 @@ def get_raw_params(exp_path: str) -> List[str]:
 
 
 def get_language(cases_path: str) -> str:
-    with open(cases_path, 'r') as f:
-        data = json.load(f)
-        with open(data['grammar_path'], 'r') as gf:
-            grammar_data = json.load(gf)
-            if 'name' in grammar_data:
-                return grammar_data['name']
-            else:
-                return data['grammar_path'].split('.')[0].split(os.path.sep)[-1]
+    data = cases_metadata(cases_path)
+    with open(data['grammar_path'], 'r') as gf:
+        grammar_data = json.load(gf)
+        if 'name' in grammar_data:
+            return grammar_data['name']
+        else:
+            return data['grammar_path'].split('.')[0].split(os.path.sep)[-1]
 
 
 def format_params(params: List[str]) -> List[str]:
@@ -44,18 +46,17 @@ def by_params(params: List[str]) -> Callable[[Dict], tuple]:
 
 
 def load_data(result_path: str) -> Tuple[str, List[str], Dict[tuple, List[float]]]:
-    with open(result_path, 'r') as f:
-        data = json.load(f)
-        language = get_language(data['cases_path'])
-        params = get_raw_params(data['experiment_path'])
+    data = load_results(result_path)
+    language = get_language(data['cases_path'])
+    params = get_raw_params(data['experiment_path'])
 
-        key_func = by_params(params)
-        res = defaultdict(list)
-        for case in data['results']:
-            k = key_func(case)
-            res[k].append(case['fitness'])
+    key_func = by_params(params)
+    res = defaultdict(list)
+    for case in data['results']:
+        k = key_func(case)
+        res[k].append(case['fitness'])
 
-        return language, params, res
+    return language, params, res
 
 
 table_header_pattern = '''\
@@ -0,0 +1,27 @@
+import json
+from typing import Iterable, List
+
+
+def read_records(lines: Iterable[str]) -> List[dict]:
+    # A run killed while writing leaves a truncated last line, it is ignored
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return records
+
+
+def load_results(path: str) -> dict:
+    # Accepts the single json results file and the streamed format: a header line followed by one record per run
+    with open(path, 'r') as f:
+        text = f.read()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    header, *records = read_records(text.splitlines())
+    header['results'] = sorted(records, key=lambda record: record['task'])
+    return header